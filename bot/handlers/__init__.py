@@ -1,7 +1,8 @@
-﻿from . import start, keywords, sources, settings, status, leads, cleanup, fallback, public
+﻿from . import start, search, keywords, sources, settings, status, leads, cleanup, fallback, public
 
 __all__ = [
     "start",
+    "search",
     "keywords",
     "sources",
     "settings",
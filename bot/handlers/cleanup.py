@@ -1,13 +1,14 @@
 ﻿from __future__ import annotations
 
-import csv
 import io
 
 from aiogram import Router
-from aiogram.types import CallbackQuery, BufferedInputFile
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import CallbackQuery
 
 from bot.handlers.start import render_main_menu_text
-from bot.keyboards.menus import cleanup_menu_kb, cleanup_confirm_kb, main_menu_kb
+from bot.keyboards.menus import cleanup_menu_kb, cleanup_confirm_kb, export_kb, main_menu_kb
+from services.export import UPLOAD_MAX_BYTES, ExportFile, ExportOptions, export_leads
 
 router = Router()
 
@@ -18,41 +19,69 @@ async def open_cleanup(callback: CallbackQuery) -> None:
         await callback.message.edit_text("🗑 Очистка / Экспорт", reply_markup=cleanup_menu_kb())
 
 
+def _export_text(options: ExportOptions) -> str:
+    period = f"{options.days} дн." if options.days else "всё время"
+    return (
+        "⬇️ Экспорт лидов\n"
+        f"Формат: {options.fmt.upper()}{' + gzip' if options.gzip else ''}\n"
+        f"Период: {period}\n"
+        f"Статус: {options.status or 'все'}\n"
+        f"Мин. score: {options.min_score or 'любой'}"
+    )
+
+
 @router.callback_query(lambda c: c.data == "cleanup:export")
-async def cleanup_export(callback: CallbackQuery, repo) -> None:
-    leads = await repo.fetch_leads_for_export(limit=2000)
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow([
-        "id",
-        "created_at",
-        "source_id",
-        "source_item_id",
-        "link",
-        "score",
-        "matched_keywords",
-        "contacts_json",
-        "status",
-        "source",
-    ])
-    for lead in leads:
-        writer.writerow([
-            lead.get("id"),
-            lead.get("created_at"),
-            lead.get("source_id"),
-            lead.get("source_item_id"),
-            lead.get("link"),
-            lead.get("score"),
-            lead.get("matched_keywords"),
-            lead.get("contacts_json"),
-            lead.get("status"),
-            lead.get("source"),
-        ])
-    data = output.getvalue().encode("utf-8")
-    file = BufferedInputFile(data, filename="leads_export.csv")
+async def cleanup_export(callback: CallbackQuery) -> None:
+    options = ExportOptions()
     if callback.message:
-        await callback.message.answer_document(file)
-        await callback.message.answer("Экспорт готов.")
+        await callback.message.edit_text(_export_text(options), reply_markup=export_kb(options))
+
+
+@router.callback_query(lambda c: c.data and c.data.startswith("exp:set:"))
+async def export_options(callback: CallbackQuery) -> None:
+    try:
+        options = ExportOptions.unpack(callback.data[len("exp:set:"):])
+    except ValueError:
+        await callback.answer("Ошибка данных")
+        return
+    await callback.answer()
+    if callback.message:
+        await callback.message.edit_text(_export_text(options), reply_markup=export_kb(options))
+
+
+@router.callback_query(lambda c: c.data and c.data.startswith("exp:go:"))
+async def export_run(callback: CallbackQuery, repo) -> None:
+    try:
+        options = ExportOptions.unpack(callback.data[len("exp:go:"):])
+    except ValueError:
+        await callback.answer("Ошибка данных")
+        return
+    await callback.answer("Готовлю экспорт…")
+    file, count = await export_leads(repo, options)
+    try:
+        if not callback.message:
+            return
+        file.seek(0, io.SEEK_END)
+        size = file.tell()
+        if size > UPLOAD_MAX_BYTES:
+            if options.gzip:
+                hint = "Выберите период короче или добавьте фильтры."
+            else:
+                hint = "Включите gzip или выберите период короче."
+            await callback.message.answer(
+                f"Файл слишком большой для Telegram: {size / 1024 / 1024:.1f} МБ "
+                f"(лимит {UPLOAD_MAX_BYTES // 1024 // 1024} МБ). {hint}",
+                reply_markup=export_kb(options),
+            )
+            return
+        try:
+            await callback.message.answer_document(ExportFile(file, options.filename))
+        except TelegramAPIError as exc:
+            await callback.message.answer(f"Не удалось отправить файл: {exc.message}", reply_markup=export_kb(options))
+            return
+        await callback.message.answer(f"Экспорт готов: {count} лидов.")
+    finally:
+        file.close()
 
 
 @router.callback_query(lambda c: c.data == "cleanup:confirm")
@@ -2,18 +2,23 @@
 
 import math
 import re
+import tempfile
+import time
 
 from aiogram import Router
 from aiogram.fsm.context import FSMContext
-from aiogram.types import CallbackQuery, Message
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, Message
 
 from bot.keyboards.menus import keywords_menu_kb, main_menu_kb
 from bot.states import KeywordStates
 from bot.handlers.start import render_main_menu_text
+from services.keyword_import import EXTENSIONS, MAX_FILE_BYTES, SPOOL_MAX_BYTES, chunked, iter_phrases
 
 router = Router()
 
 PAGE_SIZE = 10
+IMPORT_BATCH = 5000
+PROGRESS_EDIT_SECONDS = 2.0
 
 
 def _detect_lang(phrase: str) -> str:
@@ -28,42 +33,103 @@ def _detect_lang(phrase: str) -> str:
     return "BOTH"
 
 
-async def _render_keywords(page: int, repo) -> tuple[str, int, int]:
-    total = await repo.count_keywords()
+async def _render_keywords(
+    repo,
+    page: int = 1,
+    after_id: int | None = None,
+    before_id: int | None = None,
+    prefix: str | None = None,
+) -> tuple[str, InlineKeyboardMarkup]:
+    total = await repo.count_keywords(prefix)
     total_pages = max(1, math.ceil(total / PAGE_SIZE))
     page = max(1, min(page, total_pages))
-    offset = (page - 1) * PAGE_SIZE
-    items = await repo.list_keywords(offset=offset, limit=PAGE_SIZE)
+    items = await repo.list_keywords(PAGE_SIZE, after_id=after_id, before_id=before_id, prefix=prefix)
+    if (after_id is not None or before_id is not None) and (
+        not items or (before_id is not None and len(items) < PAGE_SIZE)
+    ):
+        # The cursor row was deleted or the list shrank under it: start from the top.
+        page = 1
+        items = await repo.list_keywords(PAGE_SIZE, prefix=prefix)
 
     if not items:
-        list_text = "(список пуст)"
+        list_text = "(ничего не найдено)" if prefix else "(список пуст)"
     else:
         lines = []
-        for idx, kw in enumerate(items, start=offset + 1):
+        for idx, kw in enumerate(items, start=(page - 1) * PAGE_SIZE + 1):
             lines.append(f"{idx}. {kw['phrase']} [{kw['lang']}]")
         list_text = "\n".join(lines)
 
-    text = (
-        "🧠 Ключевые слова\n"
-        f"Страница {page}/{total_pages}\n\n"
-        f"{list_text}"
+    header = "🧠 Ключевые слова\n"
+    if prefix:
+        header += f"Поиск: «{prefix}…», найдено {total}\n"
+    text = f"{header}Страница {page}/{total_pages}\n\n{list_text}"
+    markup = keywords_menu_kb(
+        page,
+        total_pages,
+        items[0]["id"] if items else None,
+        items[-1]["id"] if items else None,
+        filtered=bool(prefix),
     )
-    return text, page, total_pages
+    return text, markup
 
 
 @router.callback_query(lambda c: c.data == "main:keywords")
-async def open_keywords(callback: CallbackQuery, repo) -> None:
-    text, page, total_pages = await _render_keywords(1, repo)
+async def open_keywords(callback: CallbackQuery, state: FSMContext, repo) -> None:
+    await state.update_data(kw_prefix=None)
+    text, markup = await _render_keywords(repo)
     if callback.message:
-        await callback.message.edit_text(text, reply_markup=keywords_menu_kb(page, total_pages))
+        await callback.message.edit_text(text, reply_markup=markup)
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("kw:page:"))
-async def keywords_page(callback: CallbackQuery, repo) -> None:
-    page = int(callback.data.split(":")[-1])
-    text, page, total_pages = await _render_keywords(page, repo)
+@router.callback_query(lambda c: c.data and c.data.startswith("kw:pg:"))
+async def keywords_page(callback: CallbackQuery, state: FSMContext, repo) -> None:
+    try:
+        _, _, page_raw, direction, cursor_raw = callback.data.split(":")
+        page, cursor = int(page_raw), int(cursor_raw)
+    except ValueError:
+        await callback.answer("Ошибка данных")
+        return
+    prefix = (await state.get_data()).get("kw_prefix")
+    text, markup = await _render_keywords(
+        repo,
+        page,
+        after_id=cursor if direction == "n" else None,
+        before_id=cursor if direction == "p" else None,
+        prefix=prefix,
+    )
+    await callback.answer()
     if callback.message:
-        await callback.message.edit_text(text, reply_markup=keywords_menu_kb(page, total_pages))
+        await callback.message.edit_text(text, reply_markup=markup)
+
+
+@router.callback_query(lambda c: c.data == "kw:find")
+async def keywords_find(callback: CallbackQuery, state: FSMContext) -> None:
+    await state.set_state(KeywordStates.find)
+    await callback.answer()
+    if callback.message:
+        await callback.message.answer("Введите начало слова/фразы (с учетом регистра):")
+
+
+@router.message(KeywordStates.find)
+async def keywords_find_value(message: Message, state: FSMContext, repo) -> None:
+    prefix = (message.text or "").strip()
+    if not (1 <= len(prefix) <= 64):
+        await message.answer("Некорректная длина. Попробуйте снова (1-64 символов).")
+        return
+    await state.set_state(None)
+    # Kept in FSM data rather than callback data: the prefix may not fit in 64 bytes.
+    await state.update_data(kw_prefix=prefix)
+    text, markup = await _render_keywords(repo, prefix=prefix)
+    await message.answer(text, reply_markup=markup)
+
+
+@router.callback_query(lambda c: c.data == "kw:reset")
+async def keywords_reset(callback: CallbackQuery, state: FSMContext, repo) -> None:
+    await state.update_data(kw_prefix=None)
+    text, markup = await _render_keywords(repo)
+    await callback.answer()
+    if callback.message:
+        await callback.message.edit_text(text, reply_markup=markup)
 
 
 @router.callback_query(lambda c: c.data == "kw:add")
@@ -87,8 +153,8 @@ async def keywords_add_value(message: Message, state: FSMContext, repo) -> None:
         await message.answer("Ключевое слово добавлено.")
     else:
         await message.answer("Такое слово уже есть.")
-    text, page, total_pages = await _render_keywords(1, repo)
-    await message.answer(text, reply_markup=keywords_menu_kb(page, total_pages))
+    text, markup = await _render_keywords(repo)
+    await message.answer(text, reply_markup=markup)
 
 
 @router.callback_query(lambda c: c.data == "kw:del")
@@ -111,8 +177,8 @@ async def keywords_delete_value(message: Message, state: FSMContext, repo) -> No
         await message.answer("Ключевое слово удалено.")
     else:
         await message.answer("Слово не найдено.")
-    text, page, total_pages = await _render_keywords(1, repo)
-    await message.answer(text, reply_markup=keywords_menu_kb(page, total_pages))
+    text, markup = await _render_keywords(repo)
+    await message.answer(text, reply_markup=markup)
 
 
 @router.callback_query(lambda c: c.data == "kw:import")
@@ -120,7 +186,71 @@ async def keywords_import(callback: CallbackQuery, state: FSMContext) -> None:
     await state.set_state(KeywordStates.import_list)
     await callback.answer()
     if callback.message:
-        await callback.message.answer("Отправьте список слов через запятую или с новой строки:")
+        await callback.message.answer(
+            "Отправьте список слов через запятую или с новой строки, либо файл .txt/.csv:"
+        )
+
+
+@router.callback_query(lambda c: c.data == "kw:import_neg")
+async def keywords_import_neg(callback: CallbackQuery, state: FSMContext) -> None:
+    await state.set_state(KeywordStates.import_neg)
+    await callback.answer()
+    if callback.message:
+        await callback.message.answer(
+            "Отправьте стоп-слова через запятую или с новой строки, либо файл .txt/.csv:"
+        )
+
+
+async def _import_document(message: Message, repo, negative: bool) -> bool:
+    document = message.document
+    filename = document.file_name or ""
+    if not filename.lower().endswith(EXTENSIONS):
+        await message.answer("Поддерживаются только файлы .txt и .csv.")
+        return False
+    if (document.file_size or 0) > MAX_FILE_BYTES:
+        await message.answer("Файл больше 20 МБ, Telegram не отдаст его боту.")
+        return False
+    progress = await message.answer("⏳ Загружаю файл…")
+    processed = added = 0
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+            await message.bot.download(document, destination=spool)
+            edited_at = time.monotonic()
+            for chunk in chunked(iter_phrases(spool, filename), IMPORT_BATCH):
+                if negative:
+                    added += await repo.import_neg_keywords(chunk)
+                else:
+                    added += await repo.import_keywords([(phrase, _detect_lang(phrase)) for phrase in chunk])
+                processed += len(chunk)
+                # One status message is edited in place, throttled to stay under edit limits.
+                if time.monotonic() - edited_at >= PROGRESS_EDIT_SECONDS:
+                    await progress.edit_text(f"⏳ Импорт: обработано {processed}, добавлено {added}…")
+                    edited_at = time.monotonic()
+    except Exception:
+        # Batches imported before the failure stay; the state is kept so the file can be resent.
+        await progress.edit_text(
+            f"❌ Не удалось импортировать файл. Обработано: {processed}, добавлено: {added}. "
+            "Отправьте файл ещё раз."
+        )
+        return False
+    await progress.edit_text(
+        f"Импорт завершен. Фраз в файле: {processed}, добавлено: {added}, уже были: {processed - added}."
+    )
+    return True
+
+
+def _split_phrases(raw: str) -> list[str]:
+    parts = [p.strip() for p in re.split(r"[\n,;]", raw) if p.strip()]
+    return [phrase for phrase in parts if 1 <= len(phrase) <= 64]
+
+
+@router.message(KeywordStates.import_list, lambda m: m.document is not None)
+async def keywords_import_file(message: Message, state: FSMContext, repo) -> None:
+    if not await _import_document(message, repo, negative=False):
+        return
+    await state.clear()
+    text, markup = await _render_keywords(repo)
+    await message.answer(text, reply_markup=markup)
 
 
 @router.message(KeywordStates.import_list)
@@ -129,16 +259,34 @@ async def keywords_import_value(message: Message, state: FSMContext, repo) -> No
     if not raw:
         await message.answer("Пустой список. Попробуйте снова.")
         return
-    parts = [p.strip() for p in re.split(r"[\n,;]", raw) if p.strip()]
-    items = []
-    for phrase in parts:
-        if 1 <= len(phrase) <= 64:
-            items.append((phrase, _detect_lang(phrase)))
+    items = [(phrase, _detect_lang(phrase)) for phrase in _split_phrases(raw)]
     added = await repo.import_keywords(items)
     await state.clear()
     await message.answer(f"Импорт завершен. Добавлено: {added}.")
-    text, page, total_pages = await _render_keywords(1, repo)
-    await message.answer(text, reply_markup=keywords_menu_kb(page, total_pages))
+    text, markup = await _render_keywords(repo)
+    await message.answer(text, reply_markup=markup)
+
+
+@router.message(KeywordStates.import_neg, lambda m: m.document is not None)
+async def keywords_import_neg_file(message: Message, state: FSMContext, repo) -> None:
+    if not await _import_document(message, repo, negative=True):
+        return
+    await state.clear()
+    text, markup = await _render_keywords(repo)
+    await message.answer(text, reply_markup=markup)
+
+
+@router.message(KeywordStates.import_neg)
+async def keywords_import_neg_value(message: Message, state: FSMContext, repo) -> None:
+    raw = (message.text or "").strip()
+    if not raw:
+        await message.answer("Пустой список. Попробуйте снова.")
+        return
+    added = await repo.import_neg_keywords(_split_phrases(raw))
+    await state.clear()
+    await message.answer(f"Импорт завершен. Добавлено в стоп-лист: {added}.")
+    text, markup = await _render_keywords(repo)
+    await message.answer(text, reply_markup=markup)
 
 
 @router.callback_query(lambda c: c.data == "kw:back")
@@ -4,7 +4,9 @@ from aiogram import Router
 from aiogram.fsm.context import FSMContext
 from aiogram.types import CallbackQuery, Message
 
+from bot.keyboards.inline import lead_actions_kb
 from bot.states import LeadStates
+from services.formatting import format_lead_message
 
 router = Router()
 
@@ -21,6 +23,18 @@ async def lead_status_update(callback: CallbackQuery, repo) -> None:
     await callback.answer("Статус обновлен")
 
 
+@router.callback_query(lambda c: c.data and c.data.startswith("lead:open:"))
+async def lead_open(callback: CallbackQuery, repo) -> None:
+    lead_id = int(callback.data.split(":")[2])
+    lead = await repo.get_lead(lead_id)
+    if lead is None:
+        await callback.answer("Лид не найден")
+        return
+    await callback.answer()
+    if callback.message:
+        await callback.message.answer(format_lead_message(lead), reply_markup=lead_actions_kb(lead_id))
+
+
 @router.callback_query(lambda c: c.data and c.data.startswith("lead:neg:"))
 async def lead_add_neg(callback: CallbackQuery, state: FSMContext) -> None:
     lead_id = int(callback.data.split(":")[2])
@@ -0,0 +1,158 @@
+﻿from __future__ import annotations
+
+from aiogram import Router
+from aiogram.enums import ParseMode
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery, Message
+
+from bot.keyboards.inline import search_results_kb
+from bot.states import SearchStates
+from services.formatting import format_search_entry, format_search_header
+from services.search import SearchQuery, parse_search
+
+router = Router()
+
+PAGE_SIZE = 5
+
+SEARCH_HELP = (
+    "🔍 Поиск по лидам\n"
+    "Введите слова для поиска. Фильтры: status:NEW|IN_PROGRESS|COLD|TRASH, "
+    "score:60, source:<часть названия или URL>\n"
+    "Пример: марина рассрочка status:NEW score:70"
+)
+
+
+async def _resolve_source(repo, value: str | None) -> tuple[int | None, str | None]:
+    if not value:
+        return None, None
+    needle = value.lower()
+    for source in await repo.list_sources_all("feed"):
+        title = source.get("title") or source.get("value")
+        if needle in (title or "").lower() or needle in (source.get("value") or "").lower():
+            return int(source["id"]), title
+    return None, None
+
+
+async def _rank_search(repo, query: SearchQuery) -> tuple[list[int], bool] | None:
+    source_id, _ = await _resolve_source(repo, query.source)
+    if query.source and source_id is None:
+        return None
+    window_start = await repo.search_window_start(
+        query.match,
+        status=query.status,
+        min_score=query.min_score,
+        source_id=source_id,
+    )
+    lead_ids = await repo.search_lead_ids(
+        query.match,
+        status=query.status,
+        min_score=query.min_score,
+        source_id=source_id,
+        window_start=window_start,
+    )
+    return lead_ids, window_start is not None
+
+
+async def _render_search(
+    repo,
+    query: SearchQuery,
+    page: int,
+    ranked_ids: list[int],
+    windowed: bool,
+) -> tuple[str, list[int], str | None]:
+    _, source_title = await _resolve_source(repo, query.source)
+    offset = (page - 1) * PAGE_SIZE
+    page_rows = await repo.search_leads(query.match, ranked_ids[offset:offset + PAGE_SIZE])
+    filters = []
+    if query.status:
+        filters.append(f"status {query.status}")
+    if query.min_score:
+        filters.append(f"score ≥{query.min_score}")
+    if source_title:
+        filters.append(f"источник {source_title}")
+    text = format_search_header(query.text, filters, page)
+    if windowed:
+        text += "Слишком много совпадений: ранжированы только самые свежие.\n"
+    if not repo.search_complete:
+        text += "Индекс ещё строится: часть старых лидов пока не находится.\n"
+    if not page_rows:
+        text += "\nНичего не найдено."
+    for index, lead in enumerate(page_rows, start=offset + 1):
+        text += format_search_entry(index, lead)
+    next_cursor = str(page + 1) if len(ranked_ids) > offset + PAGE_SIZE else None
+    return text, [int(lead["id"]) for lead in page_rows], next_cursor
+
+
+async def _run_search(message: Message, state: FSMContext, repo, raw: str) -> None:
+    query = parse_search(raw)
+    if query is None:
+        await message.answer("Пустой запрос. " + SEARCH_HELP)
+        return
+    ranked = await _rank_search(repo, query)
+    if ranked is None:
+        await message.answer(f"Источник не найден: {query.source}")
+        return
+    ranked_ids, windowed = ranked
+    # The ranked ids are taken once and kept in FSM data with the query: later pages
+    # slice this list, so they never skip or repeat leads as ranks drift.
+    await state.update_data(search=raw, search_ids=ranked_ids, search_windowed=windowed)
+    text, lead_ids, next_cursor = await _render_search(repo, query, 1, ranked_ids, windowed)
+    await message.answer(
+        text,
+        parse_mode=ParseMode.HTML,
+        reply_markup=search_results_kb(lead_ids, 1, next_cursor),
+        disable_web_page_preview=True,
+    )
+
+
+@router.message(Command("search"))
+async def cmd_search(message: Message, command: CommandObject, state: FSMContext, repo) -> None:
+    if not command.args:
+        await state.set_state(SearchStates.query)
+        await message.answer(SEARCH_HELP)
+        return
+    await state.set_state(None)
+    await _run_search(message, state, repo, command.args)
+
+
+@router.callback_query(lambda c: c.data == "main:search")
+async def open_search(callback: CallbackQuery, state: FSMContext) -> None:
+    await state.set_state(SearchStates.query)
+    await callback.answer()
+    if callback.message:
+        await callback.message.answer(SEARCH_HELP)
+
+
+@router.message(SearchStates.query)
+async def search_query(message: Message, state: FSMContext, repo) -> None:
+    await state.set_state(None)
+    await _run_search(message, state, repo, message.text or "")
+
+
+@router.callback_query(lambda c: c.data and (c.data == "srch:first" or c.data.startswith("srch:next:")))
+async def search_page(callback: CallbackQuery, state: FSMContext, repo) -> None:
+    data = await state.get_data()
+    raw = data.get("search")
+    query = parse_search(raw) if raw else None
+    if query is None or "search_ids" not in data:
+        await callback.answer("Поиск устарел, повторите запрос")
+        return
+    page = 1
+    if callback.data.startswith("srch:next:"):
+        try:
+            page = int(callback.data[len("srch:next:"):])
+        except ValueError:
+            await callback.answer("Ошибка данных")
+            return
+    rendered = await _render_search(repo, query, page, data["search_ids"], data.get("search_windowed", False))
+    await callback.answer()
+    if not callback.message:
+        return
+    text, lead_ids, next_cursor = rendered
+    await callback.message.edit_text(
+        text,
+        parse_mode=ParseMode.HTML,
+        reply_markup=search_results_kb(lead_ids, (page - 1) * PAGE_SIZE + 1, next_cursor),
+        disable_web_page_preview=True,
+    )
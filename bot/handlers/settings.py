@@ -11,6 +11,7 @@ from bot.keyboards.menus import (
     target_kb,
     lang_kb,
     max_results_kb,
+    delivery_kb,
 )
 from bot.states import SettingStates
 
@@ -28,16 +29,47 @@ def _settings_text(settings: dict[str, str]) -> str:
         f"MIN_SCORE: {settings.get('min_score', '60')}\n"
         f"Куда слать: {target} ({channel_id})\n"
         f"Язык фильтров: {settings.get('lang_filter', 'BOTH')}\n"
-        f"Лимит за цикл: {settings.get('max_results', '10')}"
+        f"Лимит за цикл: {settings.get('max_results', '10')}\n"
+        f"Доставка: {_delivery_text(settings)}"
+    )
+
+
+def _delivery_text(settings: dict[str, str]) -> str:
+    if settings.get("delivery_mode") != "DIGEST":
+        return "сразу"
+    window = int(settings.get("digest_window") or 0) // 60
+    instant = int(settings.get("digest_instant_score") or 0)
+    hot = "никогда" if instant > 100 else f"от {instant}"
+    return f"дайджест раз в {window} мин, сразу: {hot}"
+
+
+def _delivery_menu_text(settings: dict[str, str]) -> str:
+    window = int(settings.get("digest_window") or 0) // 60
+    instant = int(settings.get("digest_instant_score") or 0)
+    mode = "дайджест" if settings.get("delivery_mode") == "DIGEST" else "сразу"
+    hot = "никогда" if instant > 100 else f"score от {instant}"
+    return (
+        f"📬 Доставка: {mode}\n"
+        f"Окно дайджеста: {window} мин\n"
+        f"Сразу в режиме дайджеста: {hot}\n"
+        "Лиды со score не ниже порога уходят сразу, остальные копятся в дайджест."
     )
 
 
 async def _load_settings(repo) -> dict[str, str]:
-    keys = ["poll_interval", "min_score", "target", "channel_id", "lang_filter", "max_results"]
-    data = {}
-    for key in keys:
-        data[key] = (await repo.get_setting(key)) or ""
-    return data
+    keys = [
+        "poll_interval",
+        "min_score",
+        "target",
+        "channel_id",
+        "lang_filter",
+        "max_results",
+        "delivery_mode",
+        "digest_window",
+        "digest_instant_score",
+    ]
+    settings = await repo.get_settings_snapshot()
+    return {key: settings.get(key) or "" for key in keys}
 
 
 @router.callback_query(lambda c: c.data == "main:settings")
@@ -231,6 +263,45 @@ async def set_max_custom(message: Message, state: FSMContext, repo) -> None:
     await message.answer(_settings_text(settings), reply_markup=settings_menu_kb())
 
 
+@router.callback_query(lambda c: c.data == "set:dlv")
+async def set_delivery_menu(callback: CallbackQuery, repo) -> None:
+    settings = await _load_settings(repo)
+    if callback.message:
+        await callback.message.edit_text(
+            _delivery_menu_text(settings),
+            reply_markup=delivery_kb(
+                settings.get("delivery_mode") or "INSTANT",
+                int(settings.get("digest_window") or 0),
+                int(settings.get("digest_instant_score") or 0),
+            ),
+        )
+
+
+@router.callback_query(lambda c: c.data and c.data.startswith("set:dlv:"))
+async def set_delivery_value(callback: CallbackQuery, repo) -> None:
+    parts = callback.data.split(":")
+    if len(parts) != 4:
+        await callback.answer("Ошибка данных")
+        return
+    field, value = parts[2], parts[3]
+    if field == "mode" and value in {"INSTANT", "DIGEST"}:
+        key = "delivery_mode"
+    elif field == "win" and value.isdigit():
+        key = "digest_window"
+    elif field == "hot" and value.isdigit():
+        key = "digest_instant_score"
+    else:
+        await callback.answer("Ошибка данных")
+        return
+    # Re-rendering an unchanged menu would fail with "message is not modified".
+    if await repo.get_setting(key) == value:
+        await callback.answer()
+        return
+    await repo.set_setting(key, value)
+    await callback.answer("Доставка обновлена")
+    await set_delivery_menu(callback, repo)
+
+
 @router.callback_query(lambda c: c.data == "set:back")
 async def settings_back(callback: CallbackQuery, repo) -> None:
     settings = await _load_settings(repo)
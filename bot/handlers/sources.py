@@ -1,10 +1,11 @@
 ﻿from __future__ import annotations
 
 import math
+import time
 
 from aiogram import Router
 from aiogram.fsm.context import FSMContext
-from aiogram.types import CallbackQuery, Message
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, Message
 
 from bot.handlers.start import render_main_menu_text
 from bot.keyboards.menus import sources_menu_kb, main_menu_kb
@@ -17,43 +18,84 @@ router = Router()
 PAGE_SIZE = 10
 
 
-async def _render_sources(page: int, repo) -> tuple[str, int, int]:
+def _health_suffix(state: dict | None, now: float) -> str:
+    if not state:
+        return ""
+    failures = state.get("failures", 0)
+    remaining = float(state.get("open_until", 0)) - now
+    if remaining > 0:
+        minutes = max(1, math.ceil(remaining / 60))
+        return f"\n   ⛔ пауза {minutes} мин, ошибок подряд: {failures} ({state.get('last_error', '')})"
+    return f"\n   ⚠️ ошибок подряд: {failures}"
+
+
+async def _render_sources(
+    repo,
+    page: int = 1,
+    after_id: int | None = None,
+    before_id: int | None = None,
+) -> tuple[str, InlineKeyboardMarkup]:
     total = await repo.count_sources("feed")
     total_pages = max(1, math.ceil(total / PAGE_SIZE))
     page = max(1, min(page, total_pages))
-    offset = (page - 1) * PAGE_SIZE
-    items = await repo.list_sources("feed", offset=offset, limit=PAGE_SIZE)
+    items = await repo.list_sources("feed", PAGE_SIZE, after_id=after_id, before_id=before_id)
+    if (after_id is not None or before_id is not None) and (
+        not items or (before_id is not None and len(items) < PAGE_SIZE)
+    ):
+        page = 1
+        items = await repo.list_sources("feed", PAGE_SIZE)
+    health = await repo.list_source_health()
+    now = time.time()
+    tripped = sum(1 for state in health.values() if float(state.get("open_until", 0)) > now)
 
     if not items:
         list_text = "(список пуст)"
     else:
         lines = []
-        for idx, src in enumerate(items, start=offset + 1):
+        for idx, src in enumerate(items, start=(page - 1) * PAGE_SIZE + 1):
             title = src.get("title") or src.get("value")
-            lines.append(f"{idx}. {title} ({src.get('value')})")
+            lines.append(f"{idx}. {title} ({src.get('value')}){_health_suffix(health.get(int(src['id'])), now)}")
         list_text = "\n".join(lines)
 
     text = (
         "📌 Источники (RSS/Atom)\n"
-        f"Страница {page}/{total_pages}\n\n"
+        f"Страница {page}/{total_pages}\n"
+        f"На паузе из-за ошибок: {tripped}\n\n"
         f"{list_text}"
     )
-    return text, page, total_pages
+    markup = sources_menu_kb(
+        page,
+        total_pages,
+        items[0]["id"] if items else None,
+        items[-1]["id"] if items else None,
+    )
+    return text, markup
 
 
 @router.callback_query(lambda c: c.data == "main:sources")
 async def open_sources(callback: CallbackQuery, repo) -> None:
-    text, page, total_pages = await _render_sources(1, repo)
+    text, markup = await _render_sources(repo)
     if callback.message:
-        await callback.message.edit_text(text, reply_markup=sources_menu_kb(page, total_pages))
+        await callback.message.edit_text(text, reply_markup=markup)
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("src:page:"))
+@router.callback_query(lambda c: c.data and c.data.startswith("src:pg:"))
 async def sources_page(callback: CallbackQuery, repo) -> None:
-    page = int(callback.data.split(":")[-1])
-    text, page, total_pages = await _render_sources(page, repo)
+    try:
+        _, _, page_raw, direction, cursor_raw = callback.data.split(":")
+        page, cursor = int(page_raw), int(cursor_raw)
+    except ValueError:
+        await callback.answer("Ошибка данных")
+        return
+    text, markup = await _render_sources(
+        repo,
+        page,
+        after_id=cursor if direction == "n" else None,
+        before_id=cursor if direction == "p" else None,
+    )
+    await callback.answer()
     if callback.message:
-        await callback.message.edit_text(text, reply_markup=sources_menu_kb(page, total_pages))
+        await callback.message.edit_text(text, reply_markup=markup)
 
 
 @router.callback_query(lambda c: c.data == "src:add")
@@ -83,8 +125,8 @@ async def sources_add_value(message: Message, state: FSMContext, repo, feed_clie
     else:
         await message.answer("Источник уже существует.")
 
-    text, page, total_pages = await _render_sources(1, repo)
-    await message.answer(text, reply_markup=sources_menu_kb(page, total_pages))
+    text, markup = await _render_sources(repo)
+    await message.answer(text, reply_markup=markup)
 
 
 @router.callback_query(lambda c: c.data == "src:del")
@@ -108,8 +150,8 @@ async def sources_delete_value(message: Message, state: FSMContext, repo) -> Non
     else:
         await message.answer("Источник не найден.")
 
-    text, page, total_pages = await _render_sources(1, repo)
-    await message.answer(text, reply_markup=sources_menu_kb(page, total_pages))
+    text, markup = await _render_sources(repo)
+    await message.answer(text, reply_markup=markup)
 
 
 @router.callback_query(lambda c: c.data == "src:back")
@@ -5,7 +5,6 @@ from aiogram.filters import CommandStart
 from aiogram.types import Message, CallbackQuery
 
 from bot.keyboards.menus import main_menu_kb
-from services.pipeline import run_monitoring_cycle
 
 router = Router()
 
@@ -32,16 +31,9 @@ async def toggle_monitoring(callback: CallbackQuery, repo) -> None:
 
 
 @router.callback_query(lambda c: c.data == "main:test")
-async def test_search(callback: CallbackQuery, repo, feed_client, bot, config) -> None:
+async def test_search(callback: CallbackQuery, scheduler) -> None:
     await callback.answer("Запускаю тестовый поиск...")
-    leads = await run_monitoring_cycle(
-        repo=repo,
-        feed_client=feed_client,
-        bot=bot,
-        config=config,
-        force=True,
-        reason="manual",
-    )
+    leads = await scheduler.run_now()
     if callback.message:
         await callback.message.answer(f"Тестовый прогон завершен. Найдено лидов: {leads}")
 
@@ -1,10 +1,13 @@
 ﻿from __future__ import annotations
 
+from datetime import datetime, timezone
+
 from aiogram import Router
 from aiogram.types import CallbackQuery
 
 from bot.handlers.start import render_main_menu_text
 from bot.keyboards.menus import status_kb, main_menu_kb
+from utils.metrics import metrics
 
 router = Router()
 
@@ -18,18 +21,76 @@ def _format_status(data: dict[str, str]) -> str:
         f"Ключевые слова: {data['keywords_count']}\n"
         f"Источники (RSS): {data['sources_count']}\n"
         f"Последний чек: {data['last_check']}\n"
-        f"Лидов сегодня: {data['leads_today']}"
+        f"Лидов сегодня: {data['leads_today']}\n"
+        f"В очереди отправки: {data['outbox_pending']}\n"
+        f"Архивация: {data['retention']}\n\n"
+        f"{data['pipeline']}"
+    )
+
+
+def _avg(name: str) -> str:
+    count, total, peak = metrics.summary_total(name)
+    if not count:
+        return "—"
+    return f"ср. {total / count:.2f}s, макс. {peak:.2f}s"
+
+
+def _pipeline_text() -> str:
+    # Counters are cumulative since the bot started; the full per-source breakdown
+    # is on the Prometheus endpoint when METRICS_PORT is set.
+    cycles, _, _ = metrics.summary_total("cycle_seconds")
+    if not cycles:
+        return "⏱ Циклы: ещё не было"
+    fetches, _, _ = metrics.summary_total("feed_fetch_seconds")
+    fetched_mb = metrics.counter_total("feed_fetch_bytes_total") / (1024 * 1024)
+    dedupe = (
+        metrics.counter_total("seen_index_hits_total")
+        + metrics.counter_total("dedupe_hits_total")
+        + metrics.counter_total("near_duplicates_total")
+    )
+    stages = ", ".join(
+        f"{title} {metrics.summary('pipeline_stage_seconds', stage=stage)[1]:.1f}s"
+        for stage, title in (("fetch", "загрузка"), ("evaluate", "оценка"), ("store", "запись"))
+    )
+    return (
+        f"⏱ Циклы: {cycles}, последний {metrics.gauge('cycle_last_seconds'):.2f}s "
+        f"при интервале {metrics.gauge('cycle_interval_seconds'):.0f}s, "
+        f"дольше интервала: {int(metrics.counter_total('cycle_overruns_total'))}\n"
+        f"Длительность цикла: {_avg('cycle_seconds')}\n"
+        f"Загрузка лент: {fetches} запросов, {_avg('feed_fetch_seconds')}, {fetched_mb:.1f} МБ, "
+        f"без изменений: {int(metrics.counter_total('feed_not_modified_total'))}, "
+        f"ошибок: {int(metrics.counter_total('feed_fetch_errors_total'))}\n"
+        f"Парсинг: {_avg('feed_parse_seconds')}\n"
+        f"Оценено записей: {int(metrics.counter_total('items_scored_total'))}, "
+        f"отсечено дублей: {int(dedupe)}\n"
+        f"Запись в БД: {_avg('cycle_db_write_seconds')}\n"
+        f"Время в стадиях: {stages}\n"
+        f"Отправка: {int(metrics.counter_total('outbox_sent_total'))}, {_avg('outbox_send_seconds')}, "
+        f"от очереди до доставки {_avg('outbox_delivery_delay_seconds')}"
     )
 
 
+def _retention_text(report: dict | None) -> str:
+    if not report:
+        return "—"
+    ran_at = datetime.fromtimestamp(report["ran_at"], timezone.utc).strftime("%Y-%m-%d %H:%M")
+    archived = sum(report.get("archived", {}).values())
+    reclaimed = report.get("reclaimed_bytes", 0) / (1024 * 1024)
+    size = report.get("size_bytes", 0) / (1024 * 1024)
+    return f"{ran_at} UTC, в архив {archived}, освобождено {reclaimed:.1f} МБ, база {size:.1f} МБ"
+
+
 async def _load_status(repo) -> dict[str, str]:
-    monitoring_enabled = await repo.get_bool_setting("monitoring_enabled", False)
-    poll_interval = await repo.get_setting("poll_interval") or "60"
-    min_score = await repo.get_setting("min_score") or "60"
+    settings = await repo.get_settings_snapshot()
+    monitoring_enabled = settings.get_bool("monitoring_enabled", False)
+    poll_interval = settings.get("poll_interval") or "60"
+    min_score = settings.get("min_score") or "60"
     keywords_count = await repo.count_keywords()
     sources_count = await repo.count_sources("feed")
-    last_check = await repo.get_setting("last_check_at") or "—"
+    last_check = settings.get("last_check_at") or "—"
     leads_today = await repo.get_leads_today_count()
+    outbox_pending = await repo.count_outbox()
+    retention = await repo.get_retention_report()
 
     return {
         "monitoring": "ON" if monitoring_enabled else "OFF",
@@ -39,6 +100,9 @@ async def _load_status(repo) -> dict[str, str]:
         "sources_count": str(sources_count),
         "last_check": last_check,
         "leads_today": str(leads_today),
+        "outbox_pending": str(outbox_pending),
+        "retention": _retention_text(retention),
+        "pipeline": _pipeline_text(),
     }
 
 
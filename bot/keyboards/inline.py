@@ -10,3 +10,29 @@ def lead_actions_kb(lead_id: int) -> InlineKeyboardMarkup:
     builder.button(text="📌 Добавить слово в стоп-лист", callback_data=f"lead:neg:{lead_id}")
     builder.adjust(3, 1)
     return builder.as_markup()
+
+
+def digest_kb(lead_ids: list[int]) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    for index, lead_id in enumerate(lead_ids, start=1):
+        builder.button(text=f"#{index}", callback_data=f"lead:open:{lead_id}")
+    builder.adjust(5)
+    return builder.as_markup()
+
+
+def search_results_kb(lead_ids: list[int], first_index: int, next_cursor: str | None) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    for index, lead_id in enumerate(lead_ids, start=first_index):
+        builder.button(text=f"#{index}", callback_data=f"lead:open:{lead_id}")
+    sizes = [len(lead_ids)] if lead_ids else []
+    nav = 0
+    if first_index > 1:
+        builder.button(text="⏮ В начало", callback_data="srch:first")
+        nav += 1
+    if next_cursor:
+        builder.button(text="➡️ Дальше", callback_data=f"srch:next:{next_cursor}")
+        nav += 1
+    if nav:
+        sizes.append(nav)
+    builder.adjust(*sizes)
+    return builder.as_markup()
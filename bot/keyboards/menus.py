@@ -1,6 +1,10 @@
-﻿from aiogram.utils.keyboard import InlineKeyboardBuilder
+﻿from dataclasses import replace
+
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardMarkup
 
+from services.export import ExportOptions
+
 
 def main_menu_kb(monitoring_enabled: bool) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
@@ -11,37 +15,66 @@ def main_menu_kb(monitoring_enabled: bool) -> InlineKeyboardMarkup:
     builder.button(text="📌 Источники", callback_data="main:sources")
     builder.button(text="⚙️ Настройки", callback_data="main:settings")
     builder.button(text="📊 Статус", callback_data="main:status")
+    builder.button(text="🔍 Поиск по лидам", callback_data="main:search")
     builder.button(text="🗑 Очистка / Экспорт", callback_data="main:cleanup")
-    builder.adjust(1, 1, 2, 2, 1)
+    builder.adjust(1, 1, 2, 2, 2)
     return builder.as_markup()
 
 
-def keywords_menu_kb(page: int, total_pages: int) -> InlineKeyboardMarkup:
+def _page_buttons(
+    builder: InlineKeyboardBuilder,
+    prefix: str,
+    page: int,
+    total_pages: int,
+    first_id: int | None,
+    last_id: int | None,
+) -> int:
+    # Page flips carry the id of the edge row as a keyset cursor: "n" continues after
+    # it, "p" goes back before it.
+    count = 0
+    if page > 1 and first_id is not None:
+        builder.button(text="⬅️ Пред.", callback_data=f"{prefix}:pg:{page-1}:p:{first_id}")
+        count += 1
+    if page < total_pages and last_id is not None:
+        builder.button(text="➡️ След.", callback_data=f"{prefix}:pg:{page+1}:n:{last_id}")
+        count += 1
+    return count
+
+
+def keywords_menu_kb(
+    page: int,
+    total_pages: int,
+    first_id: int | None = None,
+    last_id: int | None = None,
+    filtered: bool = False,
+) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
-    if total_pages > 1:
-        if page > 1:
-            builder.button(text="⬅️ Пред.", callback_data=f"kw:page:{page-1}")
-        if page < total_pages:
-            builder.button(text="➡️ След.", callback_data=f"kw:page:{page+1}")
+    nav = _page_buttons(builder, "kw", page, total_pages, first_id, last_id)
     builder.button(text="➕ Добавить", callback_data="kw:add")
     builder.button(text="➖ Удалить", callback_data="kw:del")
     builder.button(text="🔄 Импорт списком", callback_data="kw:import")
+    builder.button(text="🚫 Импорт стоп-слов", callback_data="kw:import_neg")
+    if filtered:
+        builder.button(text="✖️ Сбросить поиск", callback_data="kw:reset")
+    else:
+        builder.button(text="🔎 Найти по началу", callback_data="kw:find")
     builder.button(text="⬅️ Назад", callback_data="kw:back")
-    builder.adjust(2, 2, 1, 1)
+    builder.adjust(*([nav] if nav else []), 2, 2, 1, 1)
     return builder.as_markup()
 
 
-def sources_menu_kb(page: int, total_pages: int) -> InlineKeyboardMarkup:
+def sources_menu_kb(
+    page: int,
+    total_pages: int,
+    first_id: int | None = None,
+    last_id: int | None = None,
+) -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
-    if total_pages > 1:
-        if page > 1:
-            builder.button(text="⬅️ Пред.", callback_data=f"src:page:{page-1}")
-        if page < total_pages:
-            builder.button(text="➡️ След.", callback_data=f"src:page:{page+1}")
+    nav = _page_buttons(builder, "src", page, total_pages, first_id, last_id)
     builder.button(text="➕ Добавить источник", callback_data="src:add")
     builder.button(text="➖ Удалить источник", callback_data="src:del")
     builder.button(text="⬅️ Назад", callback_data="src:back")
-    builder.adjust(2, 2, 1)
+    builder.adjust(*([nav] if nav else []), 2, 1)
     return builder.as_markup()
 
 
@@ -52,8 +85,9 @@ def settings_menu_kb() -> InlineKeyboardMarkup:
     builder.button(text="📤 Куда слать лиды", callback_data="set:target")
     builder.button(text="🌐 Язык фильтров", callback_data="set:lang")
     builder.button(text="🔔 Лимит за цикл", callback_data="set:max")
+    builder.button(text="📬 Доставка / дайджест", callback_data="set:dlv")
     builder.button(text="⬅️ Назад", callback_data="main:back")
-    builder.adjust(1, 1, 1, 1, 1, 1)
+    builder.adjust(1, 1, 1, 1, 1, 1, 1)
     return builder.as_markup()
 
 
@@ -106,6 +140,24 @@ def max_results_kb() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+def delivery_kb(mode: str, window: int, instant_score: int) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    for value, title in (("INSTANT", "Сразу"), ("DIGEST", "Дайджест")):
+        mark = "✅ " if value == mode else ""
+        builder.button(text=f"{mark}{title}", callback_data=f"set:dlv:mode:{value}")
+    for minutes in (5, 15, 30, 60):
+        mark = "✅ " if minutes * 60 == window else ""
+        builder.button(text=f"{mark}{minutes} мин", callback_data=f"set:dlv:win:{minutes * 60}")
+    for score in (70, 80, 90, 101):
+        active = instant_score > 100 if score > 100 else score == instant_score
+        mark = "✅ " if active else ""
+        title = "никогда" if score > 100 else f"≥{score}"
+        builder.button(text=f"{mark}{title}", callback_data=f"set:dlv:hot:{score}")
+    builder.button(text="⬅️ Назад", callback_data="set:back")
+    builder.adjust(2, 4, 4, 1)
+    return builder.as_markup()
+
+
 def status_kb() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="🔄 Обновить", callback_data="status:refresh")
@@ -116,13 +168,34 @@ def status_kb() -> InlineKeyboardMarkup:
 
 def cleanup_menu_kb() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
-    builder.button(text="⬇️ Экспорт CSV", callback_data="cleanup:export")
+    builder.button(text="⬇️ Экспорт", callback_data="cleanup:export")
     builder.button(text="🧹 Очистить лиды", callback_data="cleanup:confirm")
     builder.button(text="⬅️ Назад", callback_data="cleanup:back")
     builder.adjust(1, 1, 1)
     return builder.as_markup()
 
 
+def export_kb(options: ExportOptions) -> InlineKeyboardMarkup:
+    def option(text: str, active: bool, **changes) -> None:
+        mark = "✅ " if active else ""
+        builder.button(text=f"{mark}{text}", callback_data=f"exp:set:{replace(options, **changes).pack()}")
+
+    builder = InlineKeyboardBuilder()
+    option("CSV", options.fmt == "csv", fmt="csv")
+    option("JSONL", options.fmt == "jsonl", fmt="jsonl")
+    option("gzip", options.gzip, gzip=not options.gzip)
+    for days, title in ((7, "7 дней"), (30, "30 дней"), (365, "Год"), (0, "Всё время")):
+        option(title, options.days == days, days=days)
+    for status, title in (("", "Все"), ("NEW", "NEW"), ("IN_PROGRESS", "В работе"), ("COLD", "COLD"), ("TRASH", "TRASH")):
+        option(title, options.status == status, status=status)
+    for score, title in ((0, "Любой score"), (60, "≥60"), (80, "≥80")):
+        option(title, options.min_score == score, min_score=score)
+    builder.button(text="⬇️ Скачать", callback_data=f"exp:go:{options.pack()}")
+    builder.button(text="⬅️ Назад", callback_data="main:cleanup")
+    builder.adjust(3, 4, 5, 3, 1, 1)
+    return builder.as_markup()
+
+
 def cleanup_confirm_kb() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text="✅ Да, очистить", callback_data="cleanup:clear")
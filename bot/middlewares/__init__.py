@@ -0,0 +1,3 @@
+﻿from .timing import TimingMiddleware
+
+__all__ = ["TimingMiddleware"]
@@ -1,3 +1,3 @@
-﻿from .forms import KeywordStates, SourceStates, SettingStates, LeadStates
+﻿from .forms import KeywordStates, SourceStates, SettingStates, LeadStates, SearchStates
 
-__all__ = ["KeywordStates", "SourceStates", "SettingStates", "LeadStates"]
+__all__ = ["KeywordStates", "SourceStates", "SettingStates", "LeadStates", "SearchStates"]
@@ -5,6 +5,8 @@ class KeywordStates(StatesGroup):
     add = State()
     delete = State()
     import_list = State()
+    import_neg = State()
+    find = State()
 
 
 class SourceStates(StatesGroup):
@@ -21,3 +23,7 @@ class SettingStates(StatesGroup):
 
 class LeadStates(StatesGroup):
     add_neg_keyword = State()
+
+
+class SearchStates(StatesGroup):
+    query = State()
@@ -15,6 +15,31 @@ class Config:
     default_min_score: int
     default_max_results_per_cycle: int
     db_path: str
+    db_readers: int
+    feed_concurrency: int
+    feed_per_host_concurrency: int
+    parse_pool_mode: str
+    parse_pool_size: int
+    poll_min_interval_seconds: int
+    poll_max_interval_seconds: int
+    poll_max_requests_per_minute: int
+    breaker_failure_threshold: int
+    breaker_base_cooldown_seconds: int
+    breaker_max_cooldown_seconds: int
+    seen_ttl_hours: int
+    near_dup_max_distance: int
+    near_dup_window_hours: int
+    default_delivery_mode: str
+    default_digest_window_seconds: int
+    default_digest_instant_score: int
+    pipeline_queue_size: int
+    pipeline_evaluate_workers: int
+    pipeline_store_workers: int
+    retention_ttl_days: dict[str, int]
+    retention_interval_hours: int
+    archive_dir: str
+    metrics_host: str
+    metrics_port: int
 
 
 def _env_int(name: str, default: int | None = None) -> int:
@@ -35,6 +60,15 @@ def _env_str(name: str, default: str | None = None) -> str:
     return value.strip()
 
 
+def _env_ttls(name: str, default: str) -> dict[str, int]:
+    ttls: dict[str, int] = {}
+    for part in _env_str(name, default).split(","):
+        status, _, days = part.partition(":")
+        if status.strip() and days.strip():
+            ttls[status.strip().upper()] = int(days)
+    return ttls
+
+
 def load_config() -> Config:
     return Config(
         telegram_token=_env_str("TELEGRAM_BOT_TOKEN"),
@@ -43,4 +77,29 @@ def load_config() -> Config:
         default_min_score=_env_int("DEFAULT_MIN_SCORE", 60),
         default_max_results_per_cycle=_env_int("DEFAULT_MAX_RESULTS_PER_CYCLE", 10),
         db_path=_env_str("DB_PATH", "data.db"),
+        db_readers=_env_int("DB_READERS", 2),
+        feed_concurrency=_env_int("FEED_CONCURRENCY", 20),
+        feed_per_host_concurrency=_env_int("FEED_PER_HOST_CONCURRENCY", 2),
+        parse_pool_mode=_env_str("PARSE_POOL_MODE", "thread").lower(),
+        parse_pool_size=_env_int("PARSE_POOL_SIZE", 2),
+        poll_min_interval_seconds=_env_int("POLL_MIN_INTERVAL_SECONDS", 15),
+        poll_max_interval_seconds=_env_int("POLL_MAX_INTERVAL_SECONDS", 1800),
+        poll_max_requests_per_minute=_env_int("POLL_MAX_REQUESTS_PER_MINUTE", 120),
+        breaker_failure_threshold=_env_int("BREAKER_FAILURE_THRESHOLD", 3),
+        breaker_base_cooldown_seconds=_env_int("BREAKER_BASE_COOLDOWN_SECONDS", 60),
+        breaker_max_cooldown_seconds=_env_int("BREAKER_MAX_COOLDOWN_SECONDS", 21600),
+        seen_ttl_hours=_env_int("SEEN_TTL_HOURS", 168),
+        near_dup_max_distance=_env_int("NEAR_DUP_MAX_DISTANCE", 3),
+        near_dup_window_hours=_env_int("NEAR_DUP_WINDOW_HOURS", 72),
+        default_delivery_mode=_env_str("DEFAULT_DELIVERY_MODE", "INSTANT").upper(),
+        default_digest_window_seconds=_env_int("DEFAULT_DIGEST_WINDOW_SECONDS", 900),
+        default_digest_instant_score=_env_int("DEFAULT_DIGEST_INSTANT_SCORE", 85),
+        pipeline_queue_size=_env_int("PIPELINE_QUEUE_SIZE", 32),
+        pipeline_evaluate_workers=_env_int("PIPELINE_EVALUATE_WORKERS", 1),
+        pipeline_store_workers=_env_int("PIPELINE_STORE_WORKERS", 1),
+        retention_ttl_days=_env_ttls("RETENTION_TTL_DAYS", "TRASH:7,COLD:90"),
+        retention_interval_hours=_env_int("RETENTION_INTERVAL_HOURS", 24),
+        archive_dir=_env_str("ARCHIVE_DIR", "archive"),
+        metrics_host=_env_str("METRICS_HOST", "127.0.0.1"),
+        metrics_port=_env_int("METRICS_PORT", 0),
     )
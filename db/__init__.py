@@ -1,3 +1,3 @@
-﻿from .repo import Repo
+﻿from .repo import Repo, SettingsSnapshot
 
-__all__ = ["Repo"]
+__all__ = ["Repo", "SettingsSnapshot"]
@@ -0,0 +1,374 @@
+﻿from __future__ import annotations
+
+import asyncio
+import logging
+import sys
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncContextManager, AsyncIterator, Awaitable, Callable
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH = 5000
+CREATED_TS_VERSION = 2
+FTS_VERSION = 5
+
+BASELINE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS keywords (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phrase TEXT NOT NULL UNIQUE,
+        lang TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS neg_keywords (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        phrase TEXT NOT NULL UNIQUE
+    );
+
+    CREATE TABLE IF NOT EXISTS sources (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        type TEXT NOT NULL,
+        value TEXT NOT NULL,
+        title TEXT,
+        UNIQUE(type, value)
+    );
+
+    CREATE TABLE IF NOT EXISTS leads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TEXT NOT NULL,
+        source_id INTEGER NOT NULL,
+        source_item_id TEXT NOT NULL,
+        text TEXT NOT NULL,
+        text_hash TEXT NOT NULL,
+        link TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        matched_keywords TEXT NOT NULL,
+        contacts_json TEXT NOT NULL,
+        status TEXT NOT NULL,
+        source TEXT NOT NULL,
+        UNIQUE(source_id, source_item_id),
+        UNIQUE(text_hash)
+    );
+
+    CREATE TABLE IF NOT EXISTS state_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS lead_fingerprints (
+        lead_id INTEGER PRIMARY KEY REFERENCES leads(id) ON DELETE CASCADE,
+        simhash INTEGER NOT NULL,
+        created_ts INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        reply_markup TEXT,
+        lead_id INTEGER,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at INTEGER NOT NULL,
+        created_at INTEGER NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(next_attempt_at, id);
+
+    CREATE TABLE IF NOT EXISTS digest_queue (
+        lead_id INTEGER PRIMARY KEY REFERENCES leads(id) ON DELETE CASCADE,
+        chat_id INTEGER NOT NULL,
+        created_ts INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS seen_items (
+        item_key INTEGER PRIMARY KEY,
+        source_id INTEGER NOT NULL,
+        seen_at INTEGER NOT NULL
+    );
+"""
+
+
+@dataclass(frozen=True)
+class Backfill:
+    table: str
+    # Runs once per rowid window with :lo and :hi bound, so every batch is a short
+    # write transaction. A backfill cut short runs again on the next start.
+    sql: str
+    # Optional statement run in the same transaction after each window, with the
+    # same parameters, to record how far the backfill got.
+    progress: str | None = None
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    schema: Callable[[aiosqlite.Connection], Awaitable[None]]
+    backfill: Backfill | None = None
+    # A full VACUUM for file-level changes such as auto_vacuum. It runs after startup
+    # but on the writer connection, so every write waits for the whole rewrite.
+    vacuum: bool = False
+
+    @property
+    def background(self) -> bool:
+        return self.backfill is not None or self.vacuum
+
+
+@dataclass(frozen=True)
+class BackfillJob:
+    migration: Migration
+    # Rowid range that existed when the schema step ran; rows added later are
+    # already written in the new shape.
+    low: int | None
+    high: int | None
+
+
+async def _columns(conn: aiosqlite.Connection, table: str) -> set[str]:
+    async with conn.execute(f"PRAGMA table_info({table})") as cur:
+        return {row[1] for row in await cur.fetchall()}
+
+
+async def _baseline(conn: aiosqlite.Connection) -> None:
+    await conn.executescript(BASELINE_SCHEMA)
+
+
+async def _leads_created_ts(conn: aiosqlite.Connection) -> None:
+    if "created_ts" not in await _columns(conn, "leads"):
+        await conn.execute("ALTER TABLE leads ADD COLUMN created_ts INTEGER")
+
+
+async def _leads_range_indexes(conn: aiosqlite.Connection) -> None:
+    # Schema steps run at connect, before any backfill, so the created_ts backfill
+    # also maintains these indexes.
+    await conn.executescript(
+        """
+        CREATE INDEX IF NOT EXISTS idx_leads_created_ts ON leads(created_ts);
+        CREATE INDEX IF NOT EXISTS idx_leads_status_created_ts ON leads(status, created_ts);
+        CREATE INDEX IF NOT EXISTS idx_leads_source_created_ts ON leads(source_id, created_ts);
+        """
+    )
+
+
+async def _auto_vacuum_mode(conn: aiosqlite.Connection) -> int:
+    async with conn.execute("PRAGMA auto_vacuum") as cur:
+        return (await cur.fetchone())[0]
+
+
+async def _incremental_auto_vacuum(conn: aiosqlite.Connection) -> None:
+    if await _auto_vacuum_mode(conn) != 2:
+        # Switching auto_vacuum on an existing file only takes effect after one full
+        # VACUUM; from then on retention can hand pages back with incremental_vacuum.
+        # The VACUUM runs after startup, but it blocks all writes while it lasts.
+        await conn.commit()
+        await conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
+
+async def _leads_fts(conn: aiosqlite.Connection) -> None:
+    # External-content index: leads_fts stores only the inverted index and reads the
+    # text back from leads by rowid. It is recreated from scratch so that a backfill
+    # interrupted halfway never leaves duplicate postings behind.
+    # leads_fts_backfill holds the rowids the backfill has not indexed yet. The delete
+    # and update triggers skip them: an FTS 'delete' for a row that was never inserted
+    # corrupts the index, and the backfill reads the current text anyway.
+    await conn.executescript(
+        """
+        DROP TRIGGER IF EXISTS leads_fts_ai;
+        DROP TRIGGER IF EXISTS leads_fts_ad;
+        DROP TRIGGER IF EXISTS leads_fts_au;
+        DROP TABLE IF EXISTS leads_fts;
+        DROP TABLE IF EXISTS leads_fts_backfill;
+
+        CREATE TABLE leads_fts_backfill (lo INTEGER, hi INTEGER);
+        INSERT INTO leads_fts_backfill(lo, hi) SELECT MIN(id), MAX(id) FROM leads;
+
+        CREATE VIRTUAL TABLE leads_fts USING fts5(
+            text,
+            content='leads',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        );
+
+        CREATE TRIGGER leads_fts_ai AFTER INSERT ON leads BEGIN
+            INSERT INTO leads_fts(rowid, text) VALUES (new.id, new.text);
+        END;
+
+        CREATE TRIGGER leads_fts_ad AFTER DELETE ON leads
+        WHEN NOT EXISTS (SELECT 1 FROM leads_fts_backfill WHERE old.id BETWEEN lo AND hi) BEGIN
+            INSERT INTO leads_fts(leads_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END;
+
+        CREATE TRIGGER leads_fts_au AFTER UPDATE OF text ON leads
+        WHEN NOT EXISTS (SELECT 1 FROM leads_fts_backfill WHERE old.id BETWEEN lo AND hi) BEGIN
+            INSERT INTO leads_fts(leads_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            INSERT INTO leads_fts(rowid, text) VALUES (new.id, new.text);
+        END;
+        """
+    )
+
+
+async def _sources_name_index(conn: aiosqlite.Connection) -> None:
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_sources_type_name ON sources(type, COALESCE(title, value), id)"
+    )
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "baseline schema", _baseline),
+    Migration(
+        CREATED_TS_VERSION,
+        "leads.created_ts epoch column",
+        _leads_created_ts,
+        backfill=Backfill(
+            "leads",
+            "UPDATE leads SET created_ts = CAST(strftime('%s', created_at) AS INTEGER) "
+            "WHERE rowid BETWEEN :lo AND :hi AND created_ts IS NULL",
+        ),
+    ),
+    Migration(3, "leads created_ts range indexes", _leads_range_indexes),
+    Migration(4, "incremental auto_vacuum", _incremental_auto_vacuum, vacuum=True),
+    Migration(
+        FTS_VERSION,
+        "leads full-text index",
+        _leads_fts,
+        backfill=Backfill(
+            "leads",
+            "INSERT INTO leads_fts(rowid, text) SELECT id, text FROM leads WHERE id BETWEEN :lo AND :hi",
+            progress="UPDATE leads_fts_backfill SET lo = :hi + 1",
+        ),
+    ),
+    Migration(6, "sources menu order index", _sources_name_index),
+]
+
+
+async def applied_versions(conn: aiosqlite.Connection) -> set[int]:
+    # Looks the table up instead of creating it, so a dry run never writes.
+    async with conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='schema_version'"
+    ) as cur:
+        if await cur.fetchone() is None:
+            return set()
+    async with conn.execute("SELECT version FROM schema_version") as cur:
+        return {int(row[0]) for row in await cur.fetchall()}
+
+
+async def schema_version(conn: aiosqlite.Connection) -> int:
+    return max(await applied_versions(conn), default=0)
+
+
+async def pending_migrations(conn: aiosqlite.Connection) -> list[Migration]:
+    # A version is recorded once its backfill finished, so a migration whose
+    # backfill was interrupted stays pending even if later ones were applied.
+    applied = await applied_versions(conn)
+    return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+
+async def _record(conn: aiosqlite.Connection, migration: Migration) -> None:
+    await conn.execute(
+        "INSERT OR REPLACE INTO schema_version(version, name, applied_at) VALUES(?, ?, ?)",
+        (migration.version, migration.name, int(time.time())),
+    )
+
+
+@asynccontextmanager
+async def _committing(conn: aiosqlite.Connection) -> AsyncIterator[None]:
+    yield
+    await conn.commit()
+
+
+async def run_backfill(
+    conn: aiosqlite.Connection,
+    job: BackfillJob,
+    transaction: Callable[[], AsyncContextManager[None]] | None = None,
+    batch_size: int = BACKFILL_BATCH,
+) -> None:
+    migration = job.migration
+    transaction = transaction or (lambda: _committing(conn))
+    started = time.monotonic()
+    backfill = migration.backfill
+    if backfill is not None and job.low is not None and job.high is not None:
+        updated = 0
+        for lo in range(job.low, job.high + 1, batch_size):
+            params = {"lo": lo, "hi": min(lo + batch_size - 1, job.high)}
+            async with transaction():
+                cur = await conn.execute(backfill.sql, params)
+                if backfill.progress is not None:
+                    await conn.execute(backfill.progress, params)
+            updated += max(cur.rowcount, 0)
+            # Yield between batches so other tasks on the loop are not starved.
+            await asyncio.sleep(0)
+        logger.info("Migration %s backfill: %s rows", migration.version, updated)
+    if migration.vacuum:
+        async with transaction():
+            if await _auto_vacuum_mode(conn) != 2:
+                logger.warning("Migration %s: running VACUUM, writes wait until it finishes", migration.version)
+                await conn.execute("VACUUM")
+    async with transaction():
+        await _record(conn, migration)
+    logger.info("Migration %s finished in %.1fs", migration.version, time.monotonic() - started)
+
+
+async def run_migrations(
+    conn: aiosqlite.Connection,
+    dry_run: bool = False,
+) -> tuple[list[Migration], list[BackfillJob]]:
+    current = await schema_version(conn)
+    steps = await pending_migrations(conn)
+    for migration in steps:
+        background = f" (batched backfill of {migration.backfill.table})" if migration.backfill else ""
+        if migration.vacuum:
+            background = " (VACUUM, blocks writes while it runs)"
+        logger.info(
+            "Migration %s -> %s: %s%s%s",
+            current,
+            migration.version,
+            migration.name,
+            background,
+            " [dry run]" if dry_run else "",
+        )
+        current = max(current, migration.version)
+    if dry_run:
+        return steps, []
+    await conn.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at INTEGER NOT NULL)"
+    )
+    jobs: list[BackfillJob] = []
+    # Only the schema steps run here; backfills and VACUUM are handed back to run
+    # after startup, one short transaction at a time.
+    for migration in steps:
+        await migration.schema(conn)
+        if migration.background:
+            low = high = None
+            if migration.backfill is not None:
+                async with conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {migration.backfill.table}") as cur:
+                    low, high = await cur.fetchone()
+            jobs.append(BackfillJob(migration, low, high))
+        else:
+            await _record(conn, migration)
+        await conn.commit()
+    return steps, jobs
+
+
+async def _main(db_path: str, dry_run: bool) -> None:
+    async with aiosqlite.connect(db_path) as conn:
+        if not dry_run:
+            await conn.execute("PRAGMA journal_mode=WAL")
+        steps, jobs = await run_migrations(conn, dry_run=dry_run)
+        for job in jobs:
+            await run_backfill(conn, job)
+        print(f"{'Planned' if dry_run else 'Applied'}: {len(steps)} step(s), schema version {await schema_version(conn)}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = [arg for arg in sys.argv[1:] if arg != "--dry-run"]
+    asyncio.run(_main(args[0] if args else "data.db", "--dry-run" in sys.argv[1:]))
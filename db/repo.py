@@ -1,81 +1,239 @@
 ﻿from __future__ import annotations
 
+import asyncio
 import json
+import os
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from itertools import islice
 from datetime import datetime, timezone
-from typing import Any, Iterable
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, AsyncIterator, Callable, Iterable, Mapping
 
 import aiosqlite
 
+from db.bloom import BloomFilter
+from db.migrations import (
+    CREATED_TS_VERSION,
+    FTS_VERSION,
+    BackfillJob,
+    Migration,
+    run_backfill,
+    run_migrations,
+)
+from utils.metrics import metrics
+
+DEDUPE_MIN_CAPACITY = 100_000
+DEDUPE_LOAD_CHUNK = 10_000
+EXPORT_CHUNK = 500
+IMPORT_CHUNK = 5000
+SEARCH_RANK_WINDOW = 2000
+# Sorts after any real character, so [prefix, prefix + PREFIX_END) is a prefix range.
+PREFIX_END = "\U0010ffff"
+
+_batch_owner: ContextVar[Any] = ContextVar("repo_batch_owner", default=None)
+
+
+@dataclass(frozen=True)
+class SettingsSnapshot:
+    values: Mapping[str, str]
+
+    def get(self, key: str, default: str | None = None) -> str | None:
+        return self.values.get(key, default)
+
+    def get_int(self, key: str, default: int) -> int:
+        value = self.values.get(key)
+        if value is None:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            return default
+
+    def get_bool(self, key: str, default: bool) -> bool:
+        value = self.values.get(key)
+        if value is None:
+            return default
+        return value == "1"
+
 
 class Repo:
-    def __init__(self, db_path: str) -> None:
+    def __init__(self, db_path: str, readers: int = 2) -> None:
         self._db_path = db_path
         self._conn: aiosqlite.Connection | None = None
+        self._reader_count = max(0, readers)
+        self._readers: asyncio.Queue[aiosqlite.Connection] | None = None
+        self._keywords_version = 0
+        self._settings: SettingsSnapshot | None = None
+        self._counts: dict[str, int] = {}
+        self._dedupe: BloomFilter | None = None
+        self._write_lock = asyncio.Lock()
+        self._pending_meta: dict[str, str | None] = {}
+        self._after_commit: list[Callable[[], None]] = []
+        self._on_rollback: list[Callable[[], None]] = []
+        self._backfills: list[BackfillJob] = []
+        self.commits = 0
+
+    @property
+    def keywords_version(self) -> int:
+        return self._keywords_version
 
     async def connect(self) -> None:
         self._conn = await aiosqlite.connect(self._db_path)
         self._conn.row_factory = aiosqlite.Row
+        # Takes effect right away only on a new file, and only before WAL is set up;
+        # existing files switch with the VACUUM of migration 4.
+        await self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
         await self._conn.execute("PRAGMA journal_mode=WAL")
         await self._conn.execute("PRAGMA foreign_keys=ON")
-        await self._create_schema()
-        await self._conn.commit()
+        await self.migrate()
+        await self._open_readers()
+        await self._load_dedupe_cache()
 
     async def close(self) -> None:
+        if self._readers is not None:
+            while not self._readers.empty():
+                await self._readers.get_nowait().close()
+            self._readers = None
         if self._conn is not None:
             await self._conn.close()
 
-    async def _create_schema(self) -> None:
-        assert self._conn is not None
-        await self._conn.executescript(
-            """
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL
-            );
-
-            CREATE TABLE IF NOT EXISTS keywords (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                phrase TEXT NOT NULL UNIQUE,
-                lang TEXT NOT NULL
-            );
-
-            CREATE TABLE IF NOT EXISTS neg_keywords (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                phrase TEXT NOT NULL UNIQUE
-            );
-
-            CREATE TABLE IF NOT EXISTS sources (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                type TEXT NOT NULL,
-                value TEXT NOT NULL,
-                title TEXT,
-                UNIQUE(type, value)
-            );
-
-            CREATE TABLE IF NOT EXISTS leads (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                created_at TEXT NOT NULL,
-                source_id INTEGER NOT NULL,
-                source_item_id TEXT NOT NULL,
-                text TEXT NOT NULL,
-                text_hash TEXT NOT NULL,
-                link TEXT NOT NULL,
-                score INTEGER NOT NULL,
-                matched_keywords TEXT NOT NULL,
-                contacts_json TEXT NOT NULL,
-                status TEXT NOT NULL,
-                source TEXT NOT NULL,
-                UNIQUE(source_id, source_item_id),
-                UNIQUE(text_hash)
-            );
-
-            CREATE TABLE IF NOT EXISTS state_meta (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL
-            );
-            """
+    async def _open_readers(self) -> None:
+        if not self._reader_count or self._db_path == ":memory:":
+            return
+        self._readers = asyncio.Queue()
+        for _ in range(self._reader_count):
+            conn = await aiosqlite.connect(f"{Path(self._db_path).resolve().as_uri()}?mode=ro", uri=True)
+            conn.row_factory = aiosqlite.Row
+            await conn.execute("PRAGMA query_only=ON")
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def _reader(self, committed: bool = False) -> AsyncIterator[aiosqlite.Connection]:
+        assert self._conn is not None
+        # WAL lets the read-only connections run beside the writer's thread. They see
+        # the last committed state, so only lookups the pipeline needs inside its own
+        # batch (dedupe, last_seen, validators) stay on the writer.
+        if self._readers is None:
+            if committed and not self.in_batch():
+                # Without a pool the writer is read instead; waiting for the write lock
+                # keeps another task's open batch out of the result.
+                async with self._write_lock:
+                    yield self._conn
+                return
+            yield self._conn
+            return
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    def in_batch(self) -> bool:
+        return _batch_owner.get() is self
+
+    def after_commit(self, callback: Callable[[], None]) -> None:
+        # In-memory state that mirrors rows written in a batch (Bloom keys, ...) is
+        # applied once the rows are committed; outside a batch they already are.
+        if self.in_batch():
+            self._after_commit.append(callback)
+        else:
+            callback()
+
+    def on_rollback(self, callback: Callable[[], None]) -> None:
+        # Undo for in-memory state that has to change before the commit, such as
+        # the seen and near-duplicate indexes the cycle itself consults.
+        if self.in_batch():
+            self._on_rollback.append(callback)
+
+    @asynccontextmanager
+    async def batch(self) -> AsyncIterator[None]:
+        assert self._conn is not None
+        # The batch belongs to the task that opened it (and tasks it spawns, which
+        # inherit the context): nested calls there join it, every other writer waits
+        # for the lock and then commits on its own, so nobody's rows end up inside
+        # someone else's transaction.
+        if self.in_batch():
+            yield
+            return
+        async with self._write_lock:
+            token = _batch_owner.set(self)
+            try:
+                yield
+                await self._flush_pending_meta()
+                if self._conn.in_transaction:
+                    await self._conn.commit()
+                    self.commits += 1
+                    metrics.inc("db_commits_total")
+            except BaseException:
+                self._pending_meta = {}
+                await self._rollback()
+                raise
+            finally:
+                _batch_owner.reset(token)
+            committed, self._after_commit = self._after_commit, []
+            self._on_rollback = []
+            for callback in committed:
+                callback()
+
+    async def _rollback(self) -> None:
+        assert self._conn is not None
+        await self._conn.rollback()
+        # Cached counts and compiled keyword sets may include rolled back rows.
+        self._counts.clear()
+        self._keywords_version += 1
+        self._settings = None
+        undo, self._on_rollback = self._on_rollback, []
+        self._after_commit = []
+        for callback in reversed(undo):
+            callback()
+
+    async def _flush_pending_meta(self) -> None:
+        assert self._conn is not None
+        if not self._pending_meta:
+            return
+        pending, self._pending_meta = self._pending_meta, {}
+        await self._conn.executemany(
+            "INSERT INTO state_meta(key, value) VALUES(?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+            [(key, value) for key, value in pending.items() if value is not None],
+        )
+        await self._conn.executemany(
+            "DELETE FROM state_meta WHERE key=?",
+            [(key,) for key, value in pending.items() if value is None],
         )
 
+    async def migrate(self, dry_run: bool = False) -> list[Migration]:
+        assert self._conn is not None
+        steps, jobs = await run_migrations(self._conn, dry_run=dry_run)
+        if not dry_run:
+            self._backfills = jobs
+        return steps
+
+    async def run_backfills(self) -> None:
+        assert self._conn is not None
+        # Every window is its own batch, so monitoring cycles and admin writes
+        # interleave with the upgrade instead of waiting for all of it.
+        while self._backfills:
+            await run_backfill(self._conn, self._backfills[0], self.batch)
+            self._backfills.pop(0)
+
+    def _backfill_pending(self, version: int) -> bool:
+        return any(job.migration.version == version for job in self._backfills)
+
+    @property
+    def search_complete(self) -> bool:
+        return not self._backfill_pending(FTS_VERSION)
+
+    def _created_ts(self) -> str:
+        # Rows written before the created_ts column have it NULL until the backfill
+        # reaches them; the fallback expression cannot use the created_ts indexes.
+        if self._backfill_pending(CREATED_TS_VERSION):
+            return "COALESCE(created_ts, CAST(strftime('%s', created_at) AS INTEGER))"
+        return "created_ts"
+
     async def ensure_defaults(self, config: Any) -> None:
         await self._set_setting_if_missing("monitoring_enabled", "0")
         await self._set_setting_if_missing("poll_interval", str(config.default_poll_interval_seconds))
@@ -85,50 +243,92 @@ class Repo:
         await self._set_setting_if_missing("target", "ADMIN")
         await self._set_setting_if_missing("channel_id", "")
         await self._set_setting_if_missing("last_check_at", "")
+        await self._set_setting_if_missing("delivery_mode", config.default_delivery_mode)
+        await self._set_setting_if_missing("digest_window", str(config.default_digest_window_seconds))
+        await self._set_setting_if_missing("digest_instant_score", str(config.default_digest_instant_score))
 
     async def _set_setting_if_missing(self, key: str, value: str) -> None:
         current = await self.get_setting(key)
         if current is None:
             await self.set_setting(key, value)
 
+    async def get_settings_snapshot(self) -> SettingsSnapshot:
+        snapshot = self._settings
+        if snapshot is None:
+            assert self._conn is not None
+            async with self._conn.execute("SELECT key, value FROM settings") as cur:
+                rows = await cur.fetchall()
+            snapshot = SettingsSnapshot(MappingProxyType({row["key"]: row["value"] for row in rows}))
+            self._settings = snapshot
+        return snapshot
+
     async def get_setting(self, key: str) -> str | None:
-        assert self._conn is not None
-        async with self._conn.execute("SELECT value FROM settings WHERE key=?", (key,)) as cur:
-            row = await cur.fetchone()
-            return row["value"] if row else None
+        return (await self.get_settings_snapshot()).get(key)
 
     async def set_setting(self, key: str, value: str) -> None:
         assert self._conn is not None
-        await self._conn.execute(
-            "INSERT INTO settings(key, value) VALUES(?, ?) "
-            "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
-            (key, value),
-        )
-        await self._conn.commit()
+        async with self.batch():
+            await self._conn.execute(
+                "INSERT INTO settings(key, value) VALUES(?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                (key, value),
+            )
+        self._settings = None
 
     async def get_int_setting(self, key: str, default: int) -> int:
-        value = await self.get_setting(key)
-        if value is None:
-            return default
-        try:
-            return int(value)
-        except ValueError:
-            return default
+        return (await self.get_settings_snapshot()).get_int(key, default)
 
     async def get_bool_setting(self, key: str, default: bool) -> bool:
-        value = await self.get_setting(key)
-        if value is None:
-            return default
-        return value == "1"
-
-    async def list_keywords(self, offset: int, limit: int) -> list[dict[str, Any]]:
-        assert self._conn is not None
-        async with self._conn.execute(
-            "SELECT id, phrase, lang FROM keywords ORDER BY phrase LIMIT ? OFFSET ?",
-            (limit, offset),
-        ) as cur:
-            rows = await cur.fetchall()
-            return [dict(row) for row in rows]
+        return (await self.get_settings_snapshot()).get_bool(key, default)
+
+    async def _cached_count(self, key: str, query: str, params: tuple[Any, ...] = ()) -> int:
+        # Menus show totals on every page flip; the table is counted once and the
+        # add/delete/import paths keep the number current from their rowcounts.
+        # Counting happens on the writer inside a batch and the adjustments are made
+        # inside the writers' batches, so no write can fall between the two.
+        if key not in self._counts:
+            assert self._conn is not None
+            async with self.batch():
+                async with self._conn.execute(query, params) as cur:
+                    row = await cur.fetchone()
+                self._counts[key] = int(row[0])
+        return self._counts[key]
+
+    def _adjust_count(self, key: str, delta: int) -> None:
+        if key in self._counts:
+            self._counts[key] += delta
+
+    async def list_keywords(
+        self,
+        limit: int,
+        after_id: int | None = None,
+        before_id: int | None = None,
+        prefix: str | None = None,
+    ) -> list[dict[str, Any]]:
+        # phrase is UNIQUE, so it alone is the keyset and its index serves every page.
+        conditions: list[str] = []
+        params: list[Any] = []
+        if prefix:
+            conditions.append("phrase >= ? AND phrase < ?")
+            params.extend((prefix, prefix + PREFIX_END))
+        order = "phrase"
+        if after_id is not None:
+            conditions.append("phrase > (SELECT phrase FROM keywords WHERE id=?)")
+            params.append(after_id)
+        elif before_id is not None:
+            conditions.append("phrase < (SELECT phrase FROM keywords WHERE id=?)")
+            params.append(before_id)
+            order = "phrase DESC"
+        query = "SELECT id, phrase, lang FROM keywords"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY {order} LIMIT ?"
+        params.append(limit)
+        async with self._reader() as conn, conn.execute(query, params) as cur:
+            rows = [dict(row) for row in await cur.fetchall()]
+        if before_id is not None:
+            rows.reverse()
+        return rows
 
     async def list_keywords_all(self) -> list[dict[str, Any]]:
         assert self._conn is not None
@@ -136,45 +336,67 @@ class Repo:
             rows = await cur.fetchall()
             return [dict(row) for row in rows]
 
-    async def count_keywords(self) -> int:
-        assert self._conn is not None
-        async with self._conn.execute("SELECT COUNT(*) AS cnt FROM keywords") as cur:
+    async def count_keywords(self, prefix: str | None = None) -> int:
+        if not prefix:
+            return await self._cached_count("keywords", "SELECT COUNT(*) FROM keywords")
+        async with self._reader() as conn, conn.execute(
+            "SELECT COUNT(*) FROM keywords WHERE phrase >= ? AND phrase < ?",
+            (prefix, prefix + PREFIX_END),
+        ) as cur:
             row = await cur.fetchone()
-            return int(row["cnt"])
+            return int(row[0])
 
     async def add_keyword(self, phrase: str, lang: str) -> bool:
         assert self._conn is not None
         try:
-            await self._conn.execute(
-                "INSERT INTO keywords(phrase, lang) VALUES(?, ?)",
-                (phrase, lang),
-            )
-            await self._conn.commit()
+            async with self.batch():
+                await self._conn.execute(
+                    "INSERT INTO keywords(phrase, lang) VALUES(?, ?)",
+                    (phrase, lang),
+                )
+                self._adjust_count("keywords", 1)
+            self._keywords_version += 1
             return True
         except aiosqlite.IntegrityError:
             return False
 
     async def delete_keyword(self, phrase: str) -> int:
         assert self._conn is not None
-        cur = await self._conn.execute("DELETE FROM keywords WHERE LOWER(phrase)=LOWER(?)", (phrase,))
-        await self._conn.commit()
+        async with self.batch():
+            cur = await self._conn.execute("DELETE FROM keywords WHERE LOWER(phrase)=LOWER(?)", (phrase,))
+            self._adjust_count("keywords", -cur.rowcount)
+        if cur.rowcount:
+            self._keywords_version += 1
         return cur.rowcount
 
-    async def import_keywords(self, phrases: Iterable[tuple[str, str]]) -> int:
+    async def _import_rows(
+        self,
+        query: str,
+        rows: Iterable[tuple[str, ...]],
+        count_key: str | None = None,
+    ) -> int:
         assert self._conn is not None
+        # INSERT OR IGNORE lets duplicates fall out inside SQLite, so each chunk is one
+        # executemany call instead of a statement and a caught IntegrityError per row.
         inserted = 0
-        for phrase, lang in phrases:
-            try:
-                await self._conn.execute(
-                    "INSERT INTO keywords(phrase, lang) VALUES(?, ?)",
-                    (phrase, lang),
-                )
-                inserted += 1
-            except aiosqlite.IntegrityError:
-                continue
-        await self._conn.commit()
+        iterator = iter(rows)
+        async with self.batch():
+            while chunk := list(islice(iterator, IMPORT_CHUNK)):
+                cur = await self._conn.executemany(query, chunk)
+                inserted += max(cur.rowcount, 0)
+            if count_key is not None:
+                self._adjust_count(count_key, inserted)
+        if inserted:
+            self._keywords_version += 1
         return inserted
 
+    async def import_keywords(self, phrases: Iterable[tuple[str, str]]) -> int:
+        return await self._import_rows(
+            "INSERT OR IGNORE INTO keywords(phrase, lang) VALUES(?, ?)",
+            phrases,
+            count_key="keywords",
+        )
+
     async def list_neg_keywords(self) -> list[str]:
         assert self._conn is not None
         async with self._conn.execute("SELECT phrase FROM neg_keywords ORDER BY phrase") as cur:
@@ -184,26 +406,53 @@ class Repo:
     async def add_neg_keyword(self, phrase: str) -> bool:
         assert self._conn is not None
         try:
-            await self._conn.execute("INSERT INTO neg_keywords(phrase) VALUES(?)", (phrase,))
-            await self._conn.commit()
+            async with self.batch():
+                await self._conn.execute("INSERT INTO neg_keywords(phrase) VALUES(?)", (phrase,))
+            self._keywords_version += 1
             return True
         except aiosqlite.IntegrityError:
             return False
 
+    async def import_neg_keywords(self, phrases: Iterable[str]) -> int:
+        return await self._import_rows(
+            "INSERT OR IGNORE INTO neg_keywords(phrase) VALUES(?)",
+            ((phrase,) for phrase in phrases),
+        )
+
     async def delete_neg_keyword(self, phrase: str) -> int:
         assert self._conn is not None
-        cur = await self._conn.execute("DELETE FROM neg_keywords WHERE LOWER(phrase)=LOWER(?)", (phrase,))
-        await self._conn.commit()
+        async with self.batch():
+            cur = await self._conn.execute("DELETE FROM neg_keywords WHERE LOWER(phrase)=LOWER(?)", (phrase,))
+        if cur.rowcount:
+            self._keywords_version += 1
         return cur.rowcount
 
-    async def list_sources(self, source_type: str, offset: int, limit: int) -> list[dict[str, Any]]:
-        assert self._conn is not None
-        async with self._conn.execute(
-            "SELECT id, type, value, title FROM sources WHERE type=? ORDER BY title LIMIT ? OFFSET ?",
-            (source_type, limit, offset),
-        ) as cur:
-            rows = await cur.fetchall()
-            return [dict(row) for row in rows]
+    async def list_sources(
+        self,
+        source_type: str,
+        limit: int,
+        after_id: int | None = None,
+        before_id: int | None = None,
+    ) -> list[dict[str, Any]]:
+        # Sources are listed by the name shown in the menu; (name, id) is the keyset
+        # and idx_sources_type_name covers it.
+        query = "SELECT id, type, value, title FROM sources WHERE type=?"
+        params: list[Any] = [source_type]
+        order = "COALESCE(title, value), id"
+        if after_id is not None:
+            query += " AND (COALESCE(title, value), id) > (SELECT COALESCE(title, value), id FROM sources WHERE id=?)"
+            params.append(after_id)
+        elif before_id is not None:
+            query += " AND (COALESCE(title, value), id) < (SELECT COALESCE(title, value), id FROM sources WHERE id=?)"
+            params.append(before_id)
+            order = "COALESCE(title, value) DESC, id DESC"
+        query += f" ORDER BY {order} LIMIT ?"
+        params.append(limit)
+        async with self._reader() as conn, conn.execute(query, params) as cur:
+            rows = [dict(row) for row in await cur.fetchall()]
+        if before_id is not None:
+            rows.reverse()
+        return rows
 
     async def list_sources_all(self, source_type: str) -> list[dict[str, Any]]:
         assert self._conn is not None
@@ -215,127 +464,540 @@ class Repo:
             return [dict(row) for row in rows]
 
     async def count_sources(self, source_type: str) -> int:
-        assert self._conn is not None
-        async with self._conn.execute(
-            "SELECT COUNT(*) AS cnt FROM sources WHERE type=?",
+        return await self._cached_count(
+            f"sources:{source_type}",
+            "SELECT COUNT(*) FROM sources WHERE type=?",
             (source_type,),
-        ) as cur:
-            row = await cur.fetchone()
-            return int(row["cnt"])
+        )
 
     async def add_source(self, source_type: str, value: str, title: str | None) -> bool:
         assert self._conn is not None
         try:
-            await self._conn.execute(
-                "INSERT INTO sources(type, value, title) VALUES(?, ?, ?)",
-                (source_type, value, title),
-            )
-            await self._conn.commit()
+            async with self.batch():
+                await self._conn.execute(
+                    "INSERT INTO sources(type, value, title) VALUES(?, ?, ?)",
+                    (source_type, value, title),
+                )
+                self._adjust_count(f"sources:{source_type}", 1)
             return True
         except aiosqlite.IntegrityError:
             return False
 
     async def delete_source(self, source_type: str, value: str) -> int:
         assert self._conn is not None
-        cur = await self._conn.execute(
-            "DELETE FROM sources WHERE type=? AND value=?",
-            (source_type, value),
-        )
-        await self._conn.commit()
+        async with self.batch():
+            await self._conn.execute(
+                "DELETE FROM state_meta WHERE key IN ("
+                "SELECT 'health:' || type || ':' || id FROM sources WHERE type=? AND value=? "
+                "UNION ALL SELECT 'validators:' || type || ':' || id FROM sources WHERE type=? AND value=?)",
+                (source_type, value, source_type, value),
+            )
+            cur = await self._conn.execute(
+                "DELETE FROM sources WHERE type=? AND value=?",
+                (source_type, value),
+            )
+            self._adjust_count(f"sources:{source_type}", -cur.rowcount)
         return cur.rowcount
 
     async def get_last_seen(self, key: str) -> int | None:
-        assert self._conn is not None
-        async with self._conn.execute("SELECT value FROM state_meta WHERE key=?", (key,)) as cur:
-            row = await cur.fetchone()
-            if not row:
-                return None
-            try:
-                return int(row["value"])
-            except ValueError:
-                return None
+        value = await self._get_state_meta(key)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            return None
 
     async def set_last_seen(self, key: str, timestamp: int) -> None:
         await self._set_state_meta(key, str(timestamp))
 
-    async def _set_state_meta(self, key: str, value: str) -> None:
+    async def get_feed_validators(self, source_id: int) -> dict[str, str]:
+        value = await self._get_state_meta(f"validators:feed:{source_id}")
+        if not value:
+            return {}
+        try:
+            data = json.loads(value)
+        except ValueError:
+            return {}
+        return {key: str(item) for key, item in data.items() if item} if isinstance(data, dict) else {}
+
+    async def set_feed_validators(self, source_id: int, validators: dict[str, str]) -> None:
+        await self._set_state_meta(f"validators:feed:{source_id}", json.dumps(validators, ensure_ascii=False))
+
+    async def list_source_health(self) -> dict[int, dict[str, Any]]:
+        prefix = "health:feed:"
+        async with self._reader() as conn, conn.execute(
+            "SELECT key, value FROM state_meta WHERE key >= ? AND key < ?",
+            (prefix, prefix[:-1] + ";"),
+        ) as cur:
+            rows = await cur.fetchall()
+        values = {row["key"]: row["value"] for row in rows}
+        if self.in_batch():
+            values.update({key: value for key, value in self._pending_meta.items() if key.startswith(prefix)})
+        health: dict[int, dict[str, Any]] = {}
+        for key, value in values.items():
+            if value is None:
+                continue
+            try:
+                health[int(key[len(prefix):])] = json.loads(value)
+            except ValueError:
+                continue
+        return health
+
+    async def set_source_health(self, source_id: int, data: dict[str, Any] | None) -> None:
+        value = json.dumps(data, ensure_ascii=False) if data is not None else None
+        await self._set_state_meta(f"health:feed:{source_id}", value)
+
+    async def _get_state_meta(self, key: str) -> str | None:
         assert self._conn is not None
-        await self._conn.execute(
-            "INSERT INTO state_meta(key, value) VALUES(?, ?) "
-            "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
-            (key, value),
-        )
-        await self._conn.commit()
+        if self.in_batch() and key in self._pending_meta:
+            return self._pending_meta[key]
+        async with self._conn.execute("SELECT value FROM state_meta WHERE key=?", (key,)) as cur:
+            row = await cur.fetchone()
+            return row["value"] if row else None
+
+    async def _set_state_meta(self, key: str, value: str | None) -> None:
+        assert self._conn is not None
+        if self.in_batch():
+            self._pending_meta[key] = value
+            return
+        async with self.batch():
+            if value is None:
+                await self._conn.execute("DELETE FROM state_meta WHERE key=?", (key,))
+            else:
+                await self._conn.execute(
+                    "INSERT INTO state_meta(key, value) VALUES(?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+                    (key, value),
+                )
 
     async def set_last_check_at(self) -> None:
         now = datetime.now(timezone.utc).isoformat()
         await self.set_setting("last_check_at", now)
 
-    async def lead_exists(self, source_id: int, source_item_id: str, text_hash: str) -> bool:
+    async def load_seen_items(self, since: int) -> list[tuple[int, int]]:
         assert self._conn is not None
         async with self._conn.execute(
-            "SELECT 1 FROM leads WHERE (source_id=? AND source_item_id=?) OR text_hash=? LIMIT 1",
-            (source_id, source_item_id, text_hash),
+            "SELECT item_key, seen_at FROM seen_items WHERE seen_at >= ?",
+            (since,),
+        ) as cur:
+            rows = await cur.fetchall()
+            return [(int(row["item_key"]), int(row["seen_at"])) for row in rows]
+
+    async def save_seen_items(self, rows: Iterable[tuple[int, int, int]]) -> None:
+        assert self._conn is not None
+        async with self.batch():
+            await self._conn.executemany(
+                "INSERT INTO seen_items(item_key, source_id, seen_at) VALUES(?, ?, ?) "
+                "ON CONFLICT(item_key) DO UPDATE SET seen_at=excluded.seen_at",
+                rows,
+            )
+
+    async def prune_seen_items(self, before: int) -> int:
+        assert self._conn is not None
+        async with self.batch():
+            cur = await self._conn.execute("DELETE FROM seen_items WHERE seen_at < ?", (before,))
+        return cur.rowcount
+
+    async def enqueue_outbox(
+        self,
+        chat_id: int,
+        text: str,
+        reply_markup: str | None = None,
+        lead_id: int | None = None,
+    ) -> int:
+        assert self._conn is not None
+        now = int(datetime.now(timezone.utc).timestamp())
+        async with self.batch():
+            cur = await self._conn.execute(
+                "INSERT INTO outbox(chat_id, text, reply_markup, lead_id, next_attempt_at, created_at) "
+                "VALUES(?, ?, ?, ?, ?, ?)",
+                (chat_id, text, reply_markup, lead_id, now, now),
+            )
+        return int(cur.lastrowid)
+
+    async def fetch_due_outbox(self, now: int, limit: int) -> list[dict[str, Any]]:
+        # Only committed messages may go out: a row from a cycle batch that is still
+        # open could be rolled back after it was already sent.
+        async with self._reader(committed=True) as conn, conn.execute(
+            "SELECT id, chat_id, text, reply_markup, lead_id, attempts, created_at FROM outbox "
+            "WHERE next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+            (now, limit),
         ) as cur:
+            rows = await cur.fetchall()
+            return [dict(row) for row in rows]
+
+    async def next_outbox_attempt_at(self) -> int | None:
+        async with self._reader(committed=True) as conn, conn.execute(
+            "SELECT MIN(next_attempt_at) AS due FROM outbox"
+        ) as cur:
+            row = await cur.fetchone()
+            return int(row["due"]) if row and row["due"] is not None else None
+
+    async def reschedule_outbox(self, message_id: int, attempts: int, next_attempt_at: int) -> None:
+        assert self._conn is not None
+        async with self.batch():
+            await self._conn.execute(
+                "UPDATE outbox SET attempts=?, next_attempt_at=? WHERE id=?",
+                (attempts, next_attempt_at, message_id),
+            )
+
+    async def delete_outbox(self, message_id: int) -> None:
+        assert self._conn is not None
+        async with self.batch():
+            await self._conn.execute("DELETE FROM outbox WHERE id=?", (message_id,))
+
+    async def count_outbox(self) -> int:
+        async with self._reader() as conn, conn.execute("SELECT COUNT(*) AS cnt FROM outbox") as cur:
             row = await cur.fetchone()
-            return row is not None
+            return int(row["cnt"])
+
+    async def add_digest_item(self, lead_id: int, chat_id: int) -> None:
+        assert self._conn is not None
+        async with self.batch():
+            await self._conn.execute(
+                "INSERT OR IGNORE INTO digest_queue(lead_id, chat_id, created_ts) VALUES(?, ?, ?)",
+                (lead_id, chat_id, int(datetime.now(timezone.utc).timestamp())),
+            )
+
+    async def digest_oldest_ts(self) -> int | None:
+        assert self._conn is not None
+        async with self._conn.execute("SELECT MIN(created_ts) AS ts FROM digest_queue") as cur:
+            row = await cur.fetchone()
+            return int(row["ts"]) if row and row["ts"] is not None else None
+
+    async def list_digest_leads(self) -> list[dict[str, Any]]:
+        assert self._conn is not None
+        async with self._conn.execute(
+            "SELECT d.chat_id, l.id, l.score, l.text, l.link, l.source "
+            "FROM digest_queue d JOIN leads l ON l.id = d.lead_id "
+            "ORDER BY d.chat_id, l.score DESC, l.id"
+        ) as cur:
+            rows = await cur.fetchall()
+            return [dict(row) for row in rows]
+
+    async def delete_digest_items(self, lead_ids: list[int]) -> None:
+        assert self._conn is not None
+        async with self.batch():
+            await self._conn.executemany(
+                "DELETE FROM digest_queue WHERE lead_id=?",
+                [(lead_id,) for lead_id in lead_ids],
+            )
+
+    async def load_fingerprints(self, since: int) -> list[tuple[int, int, int]]:
+        assert self._conn is not None
+        async with self._conn.execute(
+            "SELECT lead_id, simhash, created_ts FROM lead_fingerprints WHERE created_ts >= ?",
+            (since,),
+        ) as cur:
+            rows = await cur.fetchall()
+            return [(int(row["lead_id"]), int(row["simhash"]), int(row["created_ts"])) for row in rows]
+
+    async def add_fingerprint(self, lead_id: int, simhash: int, created_ts: int) -> None:
+        assert self._conn is not None
+        async with self.batch():
+            await self._conn.execute(
+                "INSERT OR REPLACE INTO lead_fingerprints(lead_id, simhash, created_ts) VALUES(?, ?, ?)",
+                (lead_id, simhash, created_ts),
+            )
+
+    async def prune_fingerprints(self, before: int) -> int:
+        assert self._conn is not None
+        async with self.batch():
+            cur = await self._conn.execute("DELETE FROM lead_fingerprints WHERE created_ts < ?", (before,))
+        return cur.rowcount
+
+    async def _load_dedupe_cache(self) -> None:
+        assert self._conn is not None
+        async with self._conn.execute("SELECT COUNT(*) AS cnt FROM leads") as cur:
+            row = await cur.fetchone()
+            total = int(row["cnt"])
+        dedupe = BloomFilter(capacity=max(DEDUPE_MIN_CAPACITY, total * 2) * 2)
+        async with self._conn.execute("SELECT source_id, source_item_id, text_hash FROM leads") as cur:
+            while True:
+                rows = await cur.fetchmany(DEDUPE_LOAD_CHUNK)
+                if not rows:
+                    break
+                dedupe.add_many(f"i:{row[0]}:{row[1]}" for row in rows)
+                dedupe.add_many(f"h:{row[2]}" for row in rows)
+        self._dedupe = dedupe
+
+    async def lead_exists(self, source_id: int, source_item_id: str, text_hash: str) -> bool:
+        assert self._conn is not None
+        item_maybe = True
+        hash_maybe = True
+        if self._dedupe is not None:
+            item_maybe = f"i:{source_id}:{source_item_id}" in self._dedupe
+            hash_maybe = f"h:{text_hash}" in self._dedupe
+            if not item_maybe and not hash_maybe:
+                metrics.inc("dedupe_cache_negative_total")
+                return False
+        metrics.inc("dedupe_db_lookups_total")
+        if item_maybe:
+            async with self._conn.execute(
+                "SELECT 1 FROM leads WHERE source_id=? AND source_item_id=? LIMIT 1",
+                (source_id, source_item_id),
+            ) as cur:
+                if await cur.fetchone() is not None:
+                    return True
+        if hash_maybe:
+            async with self._conn.execute(
+                "SELECT 1 FROM leads WHERE text_hash=? LIMIT 1",
+                (text_hash,),
+            ) as cur:
+                if await cur.fetchone() is not None:
+                    return True
+        return False
 
     async def add_lead(self, payload: dict[str, Any]) -> int | None:
         assert self._conn is not None
-        created_at = datetime.now(timezone.utc).isoformat()
+        now = datetime.now(timezone.utc)
+        created_at = now.isoformat()
         matched_keywords = json.dumps(payload.get("matched_keywords", []), ensure_ascii=False)
         contacts_json = json.dumps(payload.get("contacts", {}), ensure_ascii=False)
-        cur = await self._conn.execute(
-            "INSERT OR IGNORE INTO leads("
-            "created_at, source_id, source_item_id, text, text_hash, link, score, matched_keywords, contacts_json, status, source"
-            ") VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (
-                created_at,
-                payload["source_id"],
-                payload["source_item_id"],
-                payload["text"],
-                payload["text_hash"],
-                payload["link"],
-                payload["score"],
-                matched_keywords,
-                contacts_json,
-                payload.get("status", "NEW"),
-                payload.get("source", "UNKNOWN"),
-            ),
-        )
-        await self._conn.commit()
+        async with self.batch():
+            cur = await self._conn.execute(
+                "INSERT OR IGNORE INTO leads("
+                "created_at, created_ts, source_id, source_item_id, text, text_hash, link, score, matched_keywords, "
+                "contacts_json, status, source"
+                ") VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    created_at,
+                    int(now.timestamp()),
+                    payload["source_id"],
+                    payload["source_item_id"],
+                    payload["text"],
+                    payload["text_hash"],
+                    payload["link"],
+                    payload["score"],
+                    matched_keywords,
+                    contacts_json,
+                    payload.get("status", "NEW"),
+                    payload.get("source", "UNKNOWN"),
+                ),
+            )
         if cur.rowcount == 0:
             return None
+        if self._dedupe is not None:
+            keys = (f"i:{payload['source_id']}:{payload['source_item_id']}", f"h:{payload['text_hash']}")
+
+            def remember() -> None:
+                if self._dedupe is not None:
+                    self._dedupe.add_many(keys)
+
+            self.after_commit(remember)
+            if self._dedupe.count > self._dedupe.capacity:
+                await self._load_dedupe_cache()
         return cur.lastrowid
 
+    async def get_lead(self, lead_id: int) -> dict[str, Any] | None:
+        async with self._reader() as conn, conn.execute(
+            "SELECT id, source_id, text, link, score, matched_keywords, contacts_json, status, source "
+            "FROM leads WHERE id=?",
+            (lead_id,),
+        ) as cur:
+            row = await cur.fetchone()
+        if row is None:
+            return None
+        lead = dict(row)
+        lead["matched_keywords"] = json.loads(lead["matched_keywords"] or "[]")
+        lead["contacts"] = json.loads(lead.pop("contacts_json") or "{}")
+        return lead
+
     async def update_lead_status(self, lead_id: int, status: str) -> None:
         assert self._conn is not None
-        await self._conn.execute(
-            "UPDATE leads SET status=? WHERE id=?",
-            (status, lead_id),
-        )
-        await self._conn.commit()
+        async with self.batch():
+            await self._conn.execute(
+                "UPDATE leads SET status=? WHERE id=?",
+                (status, lead_id),
+            )
 
     async def get_leads_today_count(self) -> int:
-        assert self._conn is not None
-        async with self._conn.execute(
-            "SELECT COUNT(*) AS cnt FROM leads WHERE date(created_at) = date('now')"
-        ) as cur:
+        start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        start_ts = int(start.timestamp())
+        return await self.count_leads_between(start_ts, start_ts + 86400)
+
+    async def count_leads_between(self, since_ts: int, until_ts: int, status: str | None = None) -> int:
+        created_ts = self._created_ts()
+        query = f"SELECT COUNT(*) AS cnt FROM leads WHERE {created_ts} >= ? AND {created_ts} < ?"
+        params: list[Any] = [since_ts, until_ts]
+        if status is not None:
+            query += " AND status=?"
+            params.append(status)
+        async with self._reader() as conn, conn.execute(query, params) as cur:
             row = await cur.fetchone()
             return int(row["cnt"])
 
-    async def fetch_leads_for_export(self, limit: int = 1000) -> list[dict[str, Any]]:
+    async def iter_leads_for_export(
+        self,
+        since_ts: int | None = None,
+        until_ts: int | None = None,
+        status: str | None = None,
+        min_score: int | None = None,
+        chunk_size: int = EXPORT_CHUNK,
+    ) -> AsyncIterator[dict[str, Any]]:
+        query = (
+            "SELECT id, created_at, source_id, source_item_id, text, link, score, matched_keywords, "
+            "contacts_json, status, source FROM leads"
+        )
+        created_ts = self._created_ts()
+        conditions: list[str] = []
+        params: list[Any] = []
+        if since_ts is not None:
+            conditions.append(f"{created_ts} >= ?")
+            params.append(since_ts)
+        if until_ts is not None:
+            conditions.append(f"{created_ts} < ?")
+            params.append(until_ts)
+        if status:
+            conditions.append("status=?")
+            params.append(status)
+        if min_score:
+            conditions.append("score >= ?")
+            params.append(min_score)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        # Newest first, as the export always was. Ids follow created_ts, and this order
+        # comes straight from a backward scan of the (status, created_ts) / created_ts
+        # indexes, so SQLite never has to sort the whole result before the first row.
+        query += f" ORDER BY {created_ts} DESC, id DESC"
+        async with self._reader() as conn, conn.execute(query, params) as cur:
+            while True:
+                rows = await cur.fetchmany(chunk_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield dict(row)
+
+    @staticmethod
+    def _search_filters(
+        status: str | None,
+        min_score: int | None,
+        source_id: int | None,
+    ) -> tuple[str, list[Any]]:
+        query = ""
+        params: list[Any] = []
+        if status:
+            query += " AND l.status=?"
+            params.append(status)
+        if min_score:
+            query += " AND l.score >= ?"
+            params.append(min_score)
+        if source_id is not None:
+            query += " AND l.source_id=?"
+            params.append(source_id)
+        return query, params
+
+    async def search_window_start(
+        self,
+        match: str,
+        status: str | None = None,
+        min_score: int | None = None,
+        source_id: int | None = None,
+        window: int = SEARCH_RANK_WINDOW,
+    ) -> int | None:
+        # bm25 has to be computed for every match before the first row can be returned,
+        # which for a word present in half of the leads means ranking millions of rows.
+        # Walking the index newest-first is lazy, so this finds the id where the newest
+        # `window` matches begin and ranking is limited to them.
+        filters, params = self._search_filters(status, min_score, source_id)
+        async with self._reader() as conn, conn.execute(
+            "SELECT l.id FROM leads_fts JOIN leads l ON l.id = leads_fts.rowid "
+            f"WHERE leads_fts MATCH ?{filters} ORDER BY leads_fts.rowid DESC LIMIT 1 OFFSET ?",
+            [match, *params, window - 1],
+        ) as cur:
+            row = await cur.fetchone()
+            return int(row["id"]) if row else None
+
+    async def search_lead_ids(
+        self,
+        match: str,
+        status: str | None = None,
+        min_score: int | None = None,
+        source_id: int | None = None,
+        window_start: int | None = None,
+        window: int = SEARCH_RANK_WINDOW,
+    ) -> list[int]:
+        # bm25 depends on corpus statistics, so a lead's rank drifts as leads are added
+        # or deleted. Callers take the ranked ids once and page through that list, which
+        # keeps every page consistent with the first one.
+        filters, params = self._search_filters(status, min_score, source_id)
+        query = (
+            "SELECT l.id FROM leads_fts JOIN leads l ON l.id = leads_fts.rowid "
+            f"WHERE leads_fts MATCH ?{filters}"
+        )
+        params.insert(0, match)
+        if window_start is not None:
+            query += " AND leads_fts.rowid >= ?"
+            params.append(window_start)
+        query += " ORDER BY leads_fts.rank, l.id LIMIT ?"
+        params.append(window)
+        async with self._reader() as conn, conn.execute(query, params) as cur:
+            rows = await cur.fetchall()
+            return [int(row["id"]) for row in rows]
+
+    async def search_leads(self, match: str, lead_ids: list[int]) -> list[dict[str, Any]]:
+        """Rows with highlighted snippets for `lead_ids`, in the order given."""
+        if not lead_ids:
+            return []
+        placeholders = ",".join("?" for _ in lead_ids)
+        query = (
+            "SELECT l.id, l.score, l.status, l.source, l.link, "
+            "COALESCE(l.created_ts, CAST(strftime('%s', l.created_at) AS INTEGER)) AS created_ts, "
+            "snippet(leads_fts, 0, char(2), char(3), '…', 16) AS snippet "
+            "FROM leads_fts JOIN leads l ON l.id = leads_fts.rowid "
+            f"WHERE leads_fts MATCH ? AND leads_fts.rowid IN ({placeholders})"
+        )
+        async with self._reader() as conn, conn.execute(query, [match, *lead_ids]) as cur:
+            rows = {int(row["id"]): dict(row) for row in await cur.fetchall()}
+        # Leads deleted since the ids were taken simply drop out of the page.
+        return [rows[lead_id] for lead_id in lead_ids if lead_id in rows]
+
+    async def fetch_expired_leads(self, status: str, before_ts: int, limit: int) -> list[dict[str, Any]]:
         assert self._conn is not None
+        created_ts = self._created_ts()
         async with self._conn.execute(
-            "SELECT id, created_at, source_id, source_item_id, link, score, matched_keywords, contacts_json, status, source "
-            "FROM leads ORDER BY id DESC LIMIT ?",
-            (limit,),
+            f"SELECT * FROM leads WHERE status=? AND {created_ts} < ? ORDER BY {created_ts}, id LIMIT ?",
+            (status, before_ts, limit),
         ) as cur:
             rows = await cur.fetchall()
             return [dict(row) for row in rows]
 
+    async def delete_leads(self, lead_ids: list[int]) -> None:
+        assert self._conn is not None
+        async with self.batch():
+            await self._conn.executemany("DELETE FROM leads WHERE id=?", [(lead_id,) for lead_id in lead_ids])
+
+    def database_size(self) -> int:
+        size = 0
+        for suffix in ("", "-wal"):
+            try:
+                size += os.path.getsize(self._db_path + suffix)
+            except OSError:
+                continue
+        return size
+
+    async def run_maintenance(self) -> None:
+        assert self._conn is not None
+        # A checkpoint cannot complete under an open write transaction, so this holds
+        # the write lock and runs between batches.
+        async with self._write_lock:
+            # incremental_vacuum frees one page per step; executescript runs the statement
+            # to completion, a plain execute would only release a single page.
+            await self._conn.executescript("PRAGMA incremental_vacuum;")
+            await self._conn.execute("PRAGMA optimize")
+            await self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    async def get_retention_report(self) -> dict[str, Any] | None:
+        value = await self._get_state_meta("retention:last")
+        return json.loads(value) if value else None
+
+    async def set_retention_report(self, report: dict[str, Any]) -> None:
+        await self._set_state_meta("retention:last", json.dumps(report, ensure_ascii=False))
+
     async def clear_leads(self) -> int:
         assert self._conn is not None
-        cur = await self._conn.execute("DELETE FROM leads")
-        await self._conn.commit()
+        async with self.batch():
+            cur = await self._conn.execute("DELETE FROM leads")
+        await self._load_dedupe_cache()
         return cur.rowcount
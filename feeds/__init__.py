@@ -1,3 +1,3 @@
-﻿from .client import FeedClient, FeedError
+﻿from .client import FeedClient, FeedError, FeedResponse
 
-__all__ = ["FeedClient", "FeedError"]
+__all__ = ["FeedClient", "FeedError", "FeedResponse"]
@@ -2,44 +2,120 @@
 
 import asyncio
 import logging
+from dataclasses import dataclass
 from typing import Any
+from urllib.parse import urlsplit
 
 import aiohttp
 
+from feeds.parser import FeedParser
+
 logger = logging.getLogger(__name__)
 
 
+RETRYABLE_STATUSES = {408, 425, 429}
+
+
 class FeedError(RuntimeError):
-    pass
+    def __init__(self, message: str, retryable: bool = True) -> None:
+        super().__init__(message)
+        self.retryable = retryable
+
+
+@dataclass(frozen=True)
+class FeedResponse:
+    body: bytes
+    etag: str | None = None
+    last_modified: str | None = None
+    not_modified: bool = False
 
 
 class FeedClient:
-    def __init__(self, timeout: int = 20, max_retries: int = 3) -> None:
+    def __init__(
+        self,
+        timeout: int = 20,
+        max_retries: int = 3,
+        max_concurrency: int = 20,
+        per_host_concurrency: int = 2,
+        parser: FeedParser | None = None,
+    ) -> None:
         self._timeout = aiohttp.ClientTimeout(total=timeout)
         self._max_retries = max_retries
         self._session: aiohttp.ClientSession | None = None
+        self._max_concurrency = max(1, max_concurrency)
+        self._global_limit = asyncio.Semaphore(self._max_concurrency)
+        self._per_host_concurrency = max(1, per_host_concurrency)
+        self._host_limits: dict[str, asyncio.Semaphore] = {}
+        self._parser = parser or FeedParser()
 
     async def _get_session(self) -> aiohttp.ClientSession:
         if self._session is None or self._session.closed:
-            self._session = aiohttp.ClientSession(timeout=self._timeout)
+            connector = aiohttp.TCPConnector(limit=self._max_concurrency)
+            self._session = aiohttp.ClientSession(timeout=self._timeout, connector=connector)
         return self._session
 
     async def close(self) -> None:
         if self._session and not self._session.closed:
             await self._session.close()
+        self._parser.close()
+
+    async def parse(self, raw: bytes, count: int = 0) -> dict[str, Any]:
+        return await self._parser.parse(raw, count)
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = asyncio.Semaphore(self._per_host_concurrency)
+            self._host_limits[host] = limit
+        return limit
 
     async def fetch(self, url: str) -> bytes:
+        response = await self.fetch_conditional(url)
+        return response.body
+
+    async def fetch_conditional(
+        self,
+        url: str,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> FeedResponse:
+        headers: dict[str, str] = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
         last_error: Exception | None = None
+        host_limit = self._host_limit(url)
         for attempt in range(self._max_retries):
             try:
                 session = await self._get_session()
-                async with session.get(url) as resp:
-                    if resp.status >= 400:
-                        raise FeedError(f"HTTP {resp.status}")
-                    return await resp.read()
+                async with host_limit, self._global_limit:
+                    async with session.get(url, headers=headers) as resp:
+                        new_etag = resp.headers.get("ETag") or etag
+                        new_last_modified = resp.headers.get("Last-Modified") or last_modified
+                        if resp.status == 304:
+                            return FeedResponse(
+                                body=b"",
+                                etag=new_etag,
+                                last_modified=new_last_modified,
+                                not_modified=True,
+                            )
+                        if resp.status >= 400:
+                            retryable = resp.status >= 500 or resp.status in RETRYABLE_STATUSES
+                            raise FeedError(f"HTTP {resp.status}", retryable=retryable)
+                        return FeedResponse(
+                            body=await resp.read(),
+                            etag=resp.headers.get("ETag"),
+                            last_modified=resp.headers.get("Last-Modified"),
+                        )
             except (aiohttp.ClientError, asyncio.TimeoutError, FeedError) as exc:
                 last_error = exc
-                await asyncio.sleep(0.5 * (attempt + 1))
+                if isinstance(exc, FeedError) and not exc.retryable:
+                    break
+                if attempt + 1 < self._max_retries:
+                    await asyncio.sleep(0.5 * (attempt + 1))
 
         logger.error("Feed fetch failed: %s %s", url, last_error)
         if last_error:
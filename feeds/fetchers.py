@@ -3,41 +3,41 @@
 import time
 from typing import Any
 
-import feedparser
-
 from feeds.client import FeedClient, FeedError
-
-
-def _entry_timestamp(entry: Any) -> int:
-    for key in ("published_parsed", "updated_parsed"):
-        ts = entry.get(key)
-        if ts:
-            return int(time.mktime(ts))
-    return 0
-
-
-async def fetch_feed_items(client: FeedClient, url: str, count: int = 50) -> list[dict[str, Any]]:
-    raw = await client.fetch(url)
-    feed = feedparser.parse(raw)
-    if feed.bozo and not feed.entries:
-        raise FeedError("Invalid feed")
-
-    items: list[dict[str, Any]] = []
-    for entry in feed.entries[:count]:
-        title = entry.get("title", "")
-        summary = entry.get("summary", "") or entry.get("description", "")
-        text = " ".join([part for part in (title, summary) if part]).strip()
-        link = entry.get("link", "")
-        guid = entry.get("id") or entry.get("guid") or link or text[:128]
-        published_ts = _entry_timestamp(entry)
-
-        items.append(
-            {
-                "item_id": str(guid),
-                "text": text,
-                "link": link,
-                "published_ts": published_ts,
-            }
+from utils.metrics import metrics
+
+
+async def fetch_feed_items(
+    client: FeedClient,
+    url: str,
+    count: int = 50,
+    validators: dict[str, str] | None = None,
+) -> tuple[list[dict[str, Any]], dict[str, str]]:
+    validators = validators or {}
+    started = time.perf_counter()
+    try:
+        response = await client.fetch_conditional(
+            url,
+            etag=validators.get("etag"),
+            last_modified=validators.get("last_modified"),
         )
+    except Exception:
+        metrics.inc("feed_fetch_errors_total", source=url)
+        raise
+    finally:
+        metrics.observe("feed_fetch_seconds", time.perf_counter() - started, source=url)
+    metrics.inc("feed_fetch_bytes_total", len(response.body), source=url)
+    new_validators = {
+        key: value
+        for key, value in (("etag", response.etag), ("last_modified", response.last_modified))
+        if value
+    }
+    if response.not_modified:
+        metrics.inc("feed_not_modified_total", source=url)
+        return [], new_validators
+
+    feed = await client.parse(response.body, count)
+    if feed["invalid"]:
+        raise FeedError("Invalid feed")
 
-    return items
+    return feed["items"], new_validators
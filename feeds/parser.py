@@ -0,0 +1,67 @@
+﻿from __future__ import annotations
+
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any
+
+import feedparser
+
+from utils.metrics import metrics
+
+
+def _entry_timestamp(entry: Any) -> int:
+    for key in ("published_parsed", "updated_parsed"):
+        ts = entry.get(key)
+        if ts:
+            return int(time.mktime(ts))
+    return 0
+
+
+def parse_feed(raw: bytes, count: int) -> dict[str, Any]:
+    feed = feedparser.parse(raw)
+
+    items: list[dict[str, Any]] = []
+    for entry in feed.entries[:count]:
+        title = entry.get("title", "")
+        summary = entry.get("summary", "") or entry.get("description", "")
+        text = " ".join([part for part in (title, summary) if part]).strip()
+        link = entry.get("link", "")
+        guid = entry.get("id") or entry.get("guid") or link or text[:128]
+        published_ts = _entry_timestamp(entry)
+
+        items.append(
+            {
+                "item_id": str(guid),
+                "text": text,
+                "link": link,
+                "published_ts": published_ts,
+            }
+        )
+
+    return {
+        "title": feed.feed.get("title") or "",
+        "invalid": bool(feed.bozo and not feed.entries),
+        "items": items,
+    }
+
+
+class FeedParser:
+    def __init__(self, workers: int = 2, mode: str = "thread") -> None:
+        workers = max(1, workers)
+        self._executor: Executor
+        if mode == "process":
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="feedparse")
+
+    async def parse(self, raw: bytes, count: int) -> dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, parse_feed, raw, count)
+        finally:
+            metrics.observe("feed_parse_seconds", time.perf_counter() - started)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
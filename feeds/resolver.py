@@ -1,7 +1,5 @@
 ﻿from __future__ import annotations
 
-import feedparser
-
 from feeds.client import FeedClient, FeedError
 
 
@@ -11,9 +9,9 @@ async def resolve_feed(client: FeedClient, url: str) -> tuple[str, str]:
         raise FeedError("Пустой URL")
 
     raw = await client.fetch(clean)
-    feed = feedparser.parse(raw)
-    if feed.bozo and not feed.entries:
+    feed = await client.parse(raw)
+    if feed["invalid"]:
         raise FeedError("Некорректный RSS/Atom feed")
 
-    title = feed.feed.get("title") or clean
+    title = feed["title"] or clean
     return clean, title
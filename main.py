@@ -10,9 +10,12 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from config import load_config
 from db import Repo
 from feeds import FeedClient
+from feeds.parser import FeedParser
 from bot.filters import AdminFilter
-from bot.handlers import start, keywords, sources, settings, status, leads, cleanup, fallback, public
+from bot.middlewares import TimingMiddleware
+from bot.handlers import start, search, keywords, sources, settings, status, leads, cleanup, fallback, public
 from services.scheduler import SchedulerService
+from utils.metrics_server import start_metrics_server
 
 logging.basicConfig(level=logging.INFO)
 
@@ -27,11 +30,15 @@ async def main() -> None:
     storage = MemoryStorage()
     dp = Dispatcher(storage=storage)
 
-    repo = Repo(config.db_path)
+    repo = Repo(config.db_path, readers=config.db_readers)
     await repo.connect()
     await repo.ensure_defaults(config)
 
-    feed_client = FeedClient()
+    feed_client = FeedClient(
+        max_concurrency=config.feed_concurrency,
+        per_host_concurrency=config.feed_per_host_concurrency,
+        parser=FeedParser(workers=config.parse_pool_size, mode=config.parse_pool_mode),
+    )
     scheduler = SchedulerService(repo, feed_client, bot, config)
 
     dp["repo"] = repo
@@ -39,6 +46,9 @@ async def main() -> None:
     dp["config"] = config
     dp["scheduler"] = scheduler
 
+    dp.message.outer_middleware(TimingMiddleware())
+    dp.callback_query.outer_middleware(TimingMiddleware())
+
     admin_filter = AdminFilter(config.admin_id)
 
     public.router.message.filter(~admin_filter)
@@ -47,6 +57,7 @@ async def main() -> None:
 
     for router in (
         start.router,
+        search.router,
         keywords.router,
         sources.router,
         settings.router,
@@ -59,10 +70,17 @@ async def main() -> None:
         router.callback_query.filter(admin_filter)
         dp.include_router(router)
 
+    metrics_runner = None
+
     async def on_startup(_: Dispatcher) -> None:
+        nonlocal metrics_runner
         await scheduler.start()
+        if config.metrics_port:
+            metrics_runner = await start_metrics_server(config.metrics_host, config.metrics_port)
 
     async def on_shutdown(_: Dispatcher) -> None:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
         await scheduler.shutdown()
         await feed_client.close()
         await repo.close()
@@ -0,0 +1,79 @@
+﻿"""Benchmark Repo.lead_exists against a large leads table.
+
+Usage: python scripts/bench_dedupe.py [--rows 1000000] [--db /tmp/bench_dedupe.db]
+
+The database is filled once and reused on later runs with the same path.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Repo  # noqa: E402
+
+SOURCES = 300
+
+
+def _item_key(i: int) -> tuple[int, str, str]:
+    return i % SOURCES, f"item-{i}", hashlib.sha256(str(i).encode()).hexdigest()
+
+
+async def _fill(path: str, rows: int) -> None:
+    repo = Repo(path)
+    await repo.connect()
+    await repo.close()
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO leads(created_at, source_id, source_item_id, text, text_hash, link, score, "
+        "matched_keywords, contacts_json, status, source) "
+        "VALUES('2024-01-01 00:00:00', ?, ?, 't', ?, '', 50, '[]', '{}', 'NEW', 'bench')",
+        (_item_key(i) for i in range(rows)),
+    )
+    conn.commit()
+    conn.close()
+
+
+async def _rate(repo: Repo, probes: list[tuple[int, str, str]], expected: bool) -> int:
+    started = time.perf_counter()
+    for probe in probes:
+        assert await repo.lead_exists(*probe) is expected
+    return int(len(probes) / (time.perf_counter() - started))
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--db", default=os.path.join("/tmp", "bench_dedupe.db"))
+    parser.add_argument("--probes", type=int, default=20_000)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"filling {args.rows} leads into {args.db}")
+        await _fill(args.db, args.rows)
+
+    repo = Repo(args.db)
+    started = time.perf_counter()
+    await repo.connect()
+    print(f"connect + filter build: {time.perf_counter() - started:.2f} s")
+
+    misses = [(i % SOURCES, f"new-{i}", hashlib.sha256(f"n{i}".encode()).hexdigest()) for i in range(args.probes)]
+    hits = [_item_key(i) for i in random.sample(range(args.rows), min(args.rows, args.probes // 4))]
+    print(f"lead_exists, new items:      {await _rate(repo, misses, False)} lookups/s")
+    print(f"lead_exists, existing items: {await _rate(repo, hits, True)} lookups/s")
+
+    # Baseline: with the filter disabled every lookup goes to SQLite.
+    repo._dedupe = None
+    print(f"lead_exists, no filter:      {await _rate(repo, misses[: args.probes // 4], False)} lookups/s")
+    await repo.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
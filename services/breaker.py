@@ -0,0 +1,57 @@
+﻿from __future__ import annotations
+
+import logging
+import time
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        repo,
+        threshold: int = 3,
+        base_cooldown: int = 60,
+        max_cooldown: int = 6 * 3600,
+    ) -> None:
+        self._repo = repo
+        self._threshold = max(1, threshold)
+        self._base_cooldown = max(1, base_cooldown)
+        self._max_cooldown = max(self._base_cooldown, max_cooldown)
+        self._health: dict[int, dict[str, Any]] = {}
+
+    async def load(self) -> None:
+        self._health = await self._repo.list_source_health()
+
+    def remaining(self, source_id: int) -> float:
+        state = self._health.get(source_id)
+        if not state:
+            return 0.0
+        return max(0.0, float(state.get("open_until", 0)) - time.time())
+
+    def is_open(self, source_id: int) -> bool:
+        return self.remaining(source_id) > 0
+
+    async def record_success(self, source_id: int) -> None:
+        if source_id not in self._health:
+            return
+        del self._health[source_id]
+        await self._repo.set_source_health(source_id, None)
+        logger.info("Source %s recovered", source_id)
+
+    async def record_failure(self, source_id: int, error: BaseException) -> None:
+        state = self._health.get(source_id, {})
+        failures = int(state.get("failures", 0)) + 1
+        open_until = 0.0
+        if failures >= self._threshold:
+            cooldown = min(self._max_cooldown, self._base_cooldown * 2 ** (failures - self._threshold))
+            open_until = time.time() + cooldown
+            logger.warning("Source %s tripped for %ss after %s failures", source_id, cooldown, failures)
+        state = {
+            "failures": failures,
+            "open_until": open_until,
+            "last_error": str(error)[:200] or type(error).__name__,
+        }
+        self._health[source_id] = state
+        await self._repo.set_source_health(source_id, state)
@@ -0,0 +1,55 @@
+﻿from __future__ import annotations
+
+import logging
+import time
+from itertools import groupby
+from typing import Any
+
+from services.formatting import format_digest_entry, format_digest_header
+from services.outbox import dump_markup
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+MAX_LEADS_PER_DIGEST = 20
+
+
+def build_digests(leads: list[dict[str, Any]]) -> list[tuple[str, list[int]]]:
+    digests: list[tuple[str, list[int]]] = []
+    entries: list[str] = []
+    lead_ids: list[int] = []
+    # The header grows by a few digits at most, so its longest form is reserved up front.
+    budget = MESSAGE_LIMIT - len(format_digest_header(MAX_LEADS_PER_DIGEST))
+    used = 0
+    for lead in leads:
+        entry = format_digest_entry(len(entries) + 1, lead)
+        if entries and (used + len(entry) > budget or len(entries) >= MAX_LEADS_PER_DIGEST):
+            digests.append((format_digest_header(len(entries)) + "".join(entries), lead_ids))
+            entries, lead_ids, used = [], [], 0
+            entry = format_digest_entry(1, lead)
+        entries.append(entry[:budget])
+        lead_ids.append(int(lead["id"]))
+        used += len(entries[-1])
+    if entries:
+        digests.append((format_digest_header(len(entries)) + "".join(entries), lead_ids))
+    return digests
+
+
+async def flush_digests(repo, window_seconds: int, force: bool = False) -> int:
+    oldest = await repo.digest_oldest_ts()
+    if oldest is None:
+        return 0
+    if not force and time.time() - oldest < window_seconds:
+        return 0
+    from bot.keyboards.inline import digest_kb
+
+    leads = await repo.list_digest_leads()
+    sent = 0
+    async with repo.batch():
+        for chat_id, chat_leads in groupby(leads, key=lambda lead: int(lead["chat_id"])):
+            for text, lead_ids in build_digests(list(chat_leads)):
+                await repo.enqueue_outbox(chat_id, text, dump_markup(digest_kb(lead_ids)))
+                sent += 1
+        await repo.delete_digest_items([int(lead["id"]) for lead in leads])
+    logger.info("Digest flushed: %s leads in %s messages", len(leads), sent)
+    return sent
@@ -0,0 +1,107 @@
+﻿from __future__ import annotations
+
+import csv
+import gzip
+import io
+import json
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import IO, AsyncGenerator
+
+from aiogram.types import InputFile
+
+EXPORT_COLUMNS = [
+    "id",
+    "created_at",
+    "source_id",
+    "source_item_id",
+    "link",
+    "score",
+    "matched_keywords",
+    "contacts_json",
+    "status",
+    "source",
+    "text",
+]
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+# Bot API limit for documents sent by a bot.
+UPLOAD_MAX_BYTES = 50 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class ExportOptions:
+    fmt: str = "csv"
+    gzip: bool = False
+    days: int = 0
+    status: str = ""
+    min_score: int = 0
+
+    def pack(self) -> str:
+        return f"{self.fmt}:{int(self.gzip)}:{self.days}:{self.status or 'ALL'}:{self.min_score}"
+
+    @classmethod
+    def unpack(cls, raw: str) -> "ExportOptions":
+        fmt, gz, days, status, min_score = raw.split(":")
+        return cls(
+            fmt="jsonl" if fmt == "jsonl" else "csv",
+            gzip=gz == "1",
+            days=int(days),
+            status="" if status == "ALL" else status,
+            min_score=int(min_score),
+        )
+
+    @property
+    def filename(self) -> str:
+        name = f"leads_export.{self.fmt}"
+        return f"{name}.gz" if self.gzip else name
+
+
+class ExportFile(InputFile):
+    def __init__(self, file: IO[bytes], filename: str) -> None:
+        super().__init__(filename=filename)
+        self._file = file
+
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        self._file.seek(0)
+        while chunk := self._file.read(self.chunk_size):
+            yield chunk
+
+
+def lead_json_line(lead: dict) -> str:
+    record = dict(lead)
+    record["matched_keywords"] = json.loads(record["matched_keywords"] or "[]")
+    record["contacts"] = json.loads(record.pop("contacts_json") or "{}")
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+async def export_leads(repo, options: ExportOptions) -> tuple[IO[bytes], int]:
+    # Rows are streamed from the cursor into a spooled file: small exports stay in
+    # memory, large ones roll over to disk instead of growing the process.
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    compressed = gzip.GzipFile(fileobj=spool, mode="wb", compresslevel=6) if options.gzip else None
+    text = io.TextIOWrapper(compressed or spool, encoding="utf-8", newline="")
+    count = 0
+    try:
+        writer = csv.writer(text) if options.fmt == "csv" else None
+        if writer is not None:
+            writer.writerow(EXPORT_COLUMNS)
+        async for lead in repo.iter_leads_for_export(
+            since_ts=int(time.time()) - options.days * 86400 if options.days else None,
+            status=options.status or None,
+            min_score=options.min_score or None,
+        ):
+            if writer is not None:
+                writer.writerow([lead.get(column) for column in EXPORT_COLUMNS])
+            else:
+                text.write(lead_json_line(lead))
+            count += 1
+        text.flush()
+        text.detach()
+        if compressed is not None:
+            compressed.close()
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, count
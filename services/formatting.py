@@ -1,5 +1,7 @@
 ﻿from __future__ import annotations
 
+import html
+from datetime import datetime, timezone
 from typing import Any
 
 from services.contacts import format_contacts
@@ -30,3 +32,32 @@ def format_lead_message(lead: dict[str, Any]) -> str:
         f"Контакты: {format_contacts(contacts)}\n"
         f"Ссылка: {link}"
     )
+
+
+def format_digest_header(count: int) -> str:
+    return f"📬 Дайджест лидов: {count}\n"
+
+
+def format_digest_entry(index: int, lead: dict[str, Any]) -> str:
+    return (
+        f"\n{index}. Score: {lead.get('score', 0)} | {lead.get('source', 'Feed')}\n"
+        f"{snippet(lead.get('text', ''), 160)}\n"
+        f"{lead.get('link', '')}\n"
+    )
+
+
+def format_search_header(text: str, filters: list[str], page: int) -> str:
+    suffix = f" ({', '.join(filters)})" if filters else ""
+    return f"🔍 Поиск: <b>{html.escape(text)}</b>{html.escape(suffix)}\nСтраница {page}\n"
+
+
+def format_search_entry(index: int, lead: dict[str, Any]) -> str:
+    # FTS5 marks matches with \x02/\x03, which survive html.escape and become <b> tags.
+    fragment = html.escape(" ".join((lead.get("snippet") or "").split()))
+    fragment = fragment.replace("\x02", "<b>").replace("\x03", "</b>")
+    created = datetime.fromtimestamp(lead.get("created_ts") or 0, timezone.utc).strftime("%Y-%m-%d")
+    return (
+        f"\n{index}. Score: {lead.get('score', 0)} | {lead.get('status', '')} | {created}\n"
+        f"{html.escape(lead.get('source', 'Feed'))}\n"
+        f"{fragment}\n"
+    )
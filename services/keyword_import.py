@@ -0,0 +1,68 @@
+﻿from __future__ import annotations
+
+import csv
+import io
+import re
+from itertools import islice
+from typing import IO, Iterable, Iterator
+
+MAX_PHRASE_LENGTH = 64
+# getFile in the Bot API refuses to hand out anything larger.
+MAX_FILE_BYTES = 20 * 1024 * 1024
+EXTENSIONS = (".txt", ".csv")
+SNIFF_BYTES = 64 * 1024
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+SPLIT_RE = re.compile(r"[,;]")
+HEADER_NAMES = {"phrase", "keyword", "keywords", "фраза", "слово", "ключевое слово"}
+
+
+def _detect_encoding(file: IO[bytes]) -> str:
+    head = file.read(SNIFF_BYTES)
+    file.seek(0)
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as exc:
+        # A multibyte character cut at the end of the sample is still UTF-8; anything
+        # earlier is most likely a cp1251 list saved from Excel.
+        if exc.start < len(head) - 3:
+            return "cp1251"
+    return "utf-8-sig"
+
+
+def _csv_dialect(text: io.TextIOWrapper) -> type[csv.Dialect] | csv.Dialect:
+    sample = text.read(SNIFF_BYTES)
+    text.seek(0)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        return csv.excel
+
+
+def iter_phrases(file: IO[bytes], filename: str) -> Iterator[str]:
+    # Reads the upload line by line, so a 100k-line list never sits in memory as one
+    # string. .csv takes the first column, .txt splits lines on "," and ";" like the
+    # text import does.
+    text = io.TextIOWrapper(file, encoding=_detect_encoding(file), errors="replace", newline="")
+    try:
+        if filename.lower().endswith(".csv"):
+            values: Iterable[str] = (row[0] for row in csv.reader(text, _csv_dialect(text)) if row)
+        else:
+            values = (part for line in text for part in SPLIT_RE.split(line))
+        first = True
+        for value in values:
+            phrase = value.strip()
+            if first and phrase.lower() in HEADER_NAMES:
+                first = False
+                continue
+            first = False
+            if 1 <= len(phrase) <= MAX_PHRASE_LENGTH:
+                yield phrase
+    finally:
+        text.detach()
+
+
+def chunked(values: Iterable[str], size: int) -> Iterator[list[str]]:
+    iterator = iter(values)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
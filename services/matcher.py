@@ -0,0 +1,75 @@
+﻿from __future__ import annotations
+
+from collections import deque
+from typing import Iterable
+
+
+class PhraseMatcher:
+    def __init__(self, patterns: Iterable[str]) -> None:
+        self._ids: dict[str, int] = {}
+        self._always: set[int] = set()
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[tuple[int, ...]] = [()]
+        for pattern in patterns:
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str) -> int:
+        pattern_id = self._ids.get(pattern)
+        if pattern_id is not None:
+            return pattern_id
+        pattern_id = len(self._ids)
+        self._ids[pattern] = pattern_id
+        if not pattern:
+            self._always.add(pattern_id)
+            return pattern_id
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = nxt
+        self._out[state] += (pattern_id,)
+        return pattern_id
+
+    def pattern_id(self, pattern: str) -> int:
+        return self._ids[pattern]
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] += self._out[self._fail[nxt]]
+        self._delta: list[dict[str, int]] = [dict(edges) for edges in self._goto]
+
+    def _step(self, state: int, ch: str) -> int:
+        origin = state
+        while state and ch not in self._goto[state]:
+            state = self._fail[state]
+        nxt = self._goto[state].get(ch, 0)
+        self._delta[origin][ch] = nxt
+        return nxt
+
+    def find(self, text: str) -> set[int]:
+        delta = self._delta
+        out = self._out
+        step = self._step
+        found = set(self._always)
+        state = 0
+        for ch in text:
+            nxt = delta[state].get(ch)
+            state = step(state, ch) if nxt is None else nxt
+            if out[state]:
+                found.update(out[state])
+        return found
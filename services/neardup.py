@@ -0,0 +1,121 @@
+﻿from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import re
+import time
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BITS = 64
+MIN_TOKENS = 8
+PRUNE_EVERY_SECONDS = 3600
+
+TOKEN_RE = re.compile(r"\w+")
+DIGITS_RE = re.compile(r"\d+")
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(text: str) -> int | None:
+    # Reposts usually differ in price or dates, so all digit runs collapse to one token.
+    tokens = TOKEN_RE.findall(DIGITS_RE.sub("0", text.lower()))
+    if len(tokens) < MIN_TOKENS:
+        return None
+    shingles = {f"{a} {b}" for a, b in zip(tokens, tokens[1:])}
+    # Majority vote per bit position, done column-wise over the binary strings.
+    rows = [format(_hash64(shingle), "064b") for shingle in shingles]
+    half = len(rows) / 2
+    fingerprint = 0
+    for position, column in enumerate(zip(*rows)):
+        if column.count("1") > half:
+            fingerprint |= 1 << (BITS - 1 - position)
+    return fingerprint
+
+
+def _to_signed(value: int) -> int:
+    return value - (1 << BITS) if value >= 1 << (BITS - 1) else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << BITS) if value < 0 else value
+
+
+class NearDuplicateIndex:
+    def __init__(self, repo, max_distance: int = 3, window_seconds: int = 72 * 3600) -> None:
+        self._repo = repo
+        self._max_distance = max(0, min(max_distance, 15))
+        # Splitting the fingerprint into max_distance + 1 bands guarantees (pigeonhole)
+        # that any fingerprint within max_distance bits shares at least one band.
+        self._bands = self._max_distance + 1
+        self._band_bits = BITS // self._bands
+        self._window = max(60, window_seconds)
+        self._buckets: dict[tuple[int, int], list[tuple[int, int, int]]] = {}
+        self._pruned_at = 0.0
+        # Held by the store path from find() to add(), see pipeline._insert_lead.
+        self.lock = asyncio.Lock()
+
+    def _band_keys(self, fingerprint: int) -> list[tuple[int, int]]:
+        mask = (1 << self._band_bits) - 1
+        return [(band, fingerprint >> (band * self._band_bits) & mask) for band in range(self._bands)]
+
+    async def load(self) -> None:
+        since = int(time.time()) - self._window
+        rows = await self._repo.load_fingerprints(since)
+        self._buckets = {}
+        for lead_id, fingerprint, created_ts in rows:
+            self._insert(lead_id, _to_unsigned(fingerprint), created_ts)
+        logger.info("Near-duplicate index loaded: %s fingerprints", len(rows))
+
+    def _insert(self, lead_id: int, fingerprint: int, created_ts: int) -> None:
+        for key in self._band_keys(fingerprint):
+            self._buckets.setdefault(key, []).append((fingerprint, lead_id, created_ts))
+
+    def discard(self, lead_id: int, fingerprint: int | None) -> None:
+        if fingerprint is None:
+            return
+        for key in self._band_keys(fingerprint):
+            entries = [entry for entry in self._buckets.get(key, ()) if entry[1] != lead_id]
+            if entries:
+                self._buckets[key] = entries
+            else:
+                self._buckets.pop(key, None)
+
+    def find(self, fingerprint: int | None) -> int | None:
+        if fingerprint is None:
+            return None
+        cutoff = time.time() - self._window
+        for key in self._band_keys(fingerprint):
+            for other, lead_id, created_ts in self._buckets.get(key, ()):
+                if created_ts >= cutoff and (fingerprint ^ other).bit_count() <= self._max_distance:
+                    metrics.inc("near_duplicates_total")
+                    return lead_id
+        return None
+
+    async def add(self, lead_id: int, fingerprint: int | None) -> None:
+        if fingerprint is None:
+            return
+        now = int(time.time())
+        self._insert(lead_id, fingerprint, now)
+        # The fingerprint is visible to the rest of the cycle right away and taken out
+        # again if the batch that stored the lead rolls back.
+        self._repo.on_rollback(lambda: self.discard(lead_id, fingerprint))
+        await self._repo.add_fingerprint(lead_id, _to_signed(fingerprint), now)
+        if now - self._pruned_at >= PRUNE_EVERY_SECONDS:
+            await self._prune(now)
+
+    async def _prune(self, now: int) -> None:
+        cutoff = now - self._window
+        for key in list(self._buckets):
+            entries = [entry for entry in self._buckets[key] if entry[2] >= cutoff]
+            if entries:
+                self._buckets[key] = entries
+            else:
+                del self._buckets[key]
+        await self._repo.prune_fingerprints(cutoff)
+        self._pruned_at = now
@@ -0,0 +1,155 @@
+﻿from __future__ import annotations
+
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramUnauthorizedError,
+)
+from aiogram.types import InlineKeyboardMarkup
+
+from services.ratelimit import TokenBucket
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second overall, one per second into a
+# private chat and 20 per minute into a group or channel.
+GLOBAL_PER_SECOND = 25
+PRIVATE_PER_SECOND = 1
+GROUP_PER_MINUTE = 20
+FETCH_LIMIT = 50
+IDLE_SECONDS = 5
+MAX_ATTEMPTS = 8
+BASE_BACKOFF_SECONDS = 5
+MAX_BACKOFF_SECONDS = 1800
+PERMANENT_ERRORS = (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound, TelegramUnauthorizedError)
+
+
+def dump_markup(markup: InlineKeyboardMarkup | None) -> str | None:
+    return markup.model_dump_json(exclude_none=True) if markup is not None else None
+
+
+def load_markup(raw: str | None) -> InlineKeyboardMarkup | None:
+    return InlineKeyboardMarkup.model_validate_json(raw) if raw else None
+
+
+class OutboxSender:
+    def __init__(self, repo, bot) -> None:
+        self._repo = repo
+        self._bot = bot
+        self._global = TokenBucket(rate=GLOBAL_PER_SECOND, capacity=GLOBAL_PER_SECOND)
+        self._chats: dict[int, TokenBucket] = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Negative ids are groups and channels, which have the stricter per-minute limit.
+            if chat_id < 0:
+                bucket = TokenBucket(rate=GROUP_PER_MINUTE / 60, capacity=3)
+            else:
+                bucket = TokenBucket(rate=PRIVATE_PER_SECOND, capacity=1)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                sent = await self._drain()
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # pragma: no cover - keep the sender alive
+                logger.exception("Outbox drain failed")
+                sent = 0
+            if sent:
+                continue
+            await self._idle()
+
+    async def _idle(self) -> None:
+        timeout = IDLE_SECONDS
+        due = await self._repo.next_outbox_attempt_at()
+        if due is not None:
+            timeout = min(timeout, max(0, due - int(time.time())))
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=max(timeout, 0.1))
+        except asyncio.TimeoutError:
+            pass
+
+    async def _drain(self) -> int:
+        rows = await self._repo.fetch_due_outbox(int(time.time()), FETCH_LIMIT)
+        metrics.set("outbox_pending", await self._repo.count_outbox())
+        sent = 0
+        for row in rows:
+            if await self._deliver(row):
+                sent += 1
+        return sent
+
+    async def _deliver(self, row: dict) -> bool:
+        chat_id = int(row["chat_id"])
+        await self._chat_bucket(chat_id).acquire()
+        await self._global.acquire()
+        started = time.perf_counter()
+        try:
+            await self._bot.send_message(
+                chat_id=chat_id,
+                text=row["text"],
+                reply_markup=load_markup(row["reply_markup"]),
+            )
+        except TelegramRetryAfter as exc:
+            # Flood control applies to the whole bot, so the sender pauses as a whole.
+            metrics.inc("outbox_retry_after_total")
+            logger.warning("Telegram flood control, retry after %ss", exc.retry_after)
+            await self._repo.reschedule_outbox(
+                row["id"], row["attempts"], int(time.time()) + exc.retry_after
+            )
+            await asyncio.sleep(exc.retry_after)
+            return False
+        except PERMANENT_ERRORS:
+            metrics.inc("outbox_dropped_total")
+            logger.exception("Dropping outbox message %s for chat_id=%s", row["id"], chat_id)
+            await self._repo.delete_outbox(row["id"])
+            return False
+        except Exception:
+            attempts = int(row["attempts"]) + 1
+            if attempts >= MAX_ATTEMPTS:
+                metrics.inc("outbox_dropped_total")
+                logger.exception("Giving up on outbox message %s after %s attempts", row["id"], attempts)
+                await self._repo.delete_outbox(row["id"])
+                return False
+            backoff = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** (attempts - 1))
+            metrics.inc("outbox_retries_total")
+            logger.warning("Failed to send outbox message %s, retry in %ss", row["id"], backoff, exc_info=True)
+            await self._repo.reschedule_outbox(row["id"], attempts, int(time.time()) + backoff)
+            return False
+        metrics.inc("outbox_sent_total")
+        metrics.observe("outbox_send_seconds", time.perf_counter() - started)
+        # From the moment the lead was queued until Telegram accepted it, including
+        # rate limiting and retries.
+        metrics.observe("outbox_delivery_delay_seconds", max(0, time.time() - int(row["created_at"])))
+        await self._repo.delete_outbox(row["id"])
+        return True
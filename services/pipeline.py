@@ -1,12 +1,20 @@
 ﻿from __future__ import annotations
 
+import heapq
 import logging
+import time
+from dataclasses import dataclass, field
 from typing import Any
 
 from services.contacts import extract_contacts
 from services.dedupe import text_hash
 from services.formatting import format_lead_message
-from services.scoring import score_text
+from services.outbox import dump_markup
+from services.neardup import NearDuplicateIndex, simhash
+from services.scoring import CompiledScorer, ScorerCache
+from services.seen import SeenIndex
+from services.stages import Stage
+from utils.metrics import metrics
 from feeds.fetchers import fetch_feed_items
 
 logger = logging.getLogger(__name__)
@@ -14,147 +22,409 @@ logger = logging.getLogger(__name__)
 FETCH_COUNT = 50
 
 
-async def run_monitoring_cycle(
-    *,
-    repo,
-    feed_client,
-    bot,
-    config,
-    force: bool,
-    reason: str,
-) -> int:
-    monitoring_enabled = await repo.get_bool_setting("monitoring_enabled", False)
-    if not monitoring_enabled and not force:
-        return 0
+@dataclass
+class CycleReport:
+    leads_sent: int = 0
+    new_items: dict[int, int] = field(default_factory=dict)
+    failed: set[int] = field(default_factory=set)
 
-    keywords = await repo.list_keywords_all()
-    if not keywords:
-        return 0
 
-    neg_keywords = await repo.list_neg_keywords()
-    min_score = await repo.get_int_setting("min_score", config.default_min_score)
-    max_results = await repo.get_int_setting("max_results", config.default_max_results_per_cycle)
-    lang_filter = (await repo.get_setting("lang_filter")) or "BOTH"
-    target = (await repo.get_setting("target")) or "ADMIN"
-    channel_id = (await repo.get_setting("channel_id")) or ""
+@dataclass
+class _SourceProgress:
+    source_id: int
+    last_seen: int | None
+    max_date: int
+    old_validators: dict[str, str]
+    new_validators: dict[str, str]
+    evaluated: list[str] = field(default_factory=list)
+    carried: list[int] = field(default_factory=list)
+    # Candidates handed to store that have not been stored or rejected yet.
+    pending: dict[str, int] = field(default_factory=dict)
 
-    leads_sent = 0
 
-    sources = await repo.list_sources_all("feed")
-    if not sources:
-        return 0
-    for source in sources:
-        if leads_sent >= max_results:
-            break
-        source_id = int(source["id"])
-        last_seen_key = f"last_seen:feed:{source_id}"
-        last_seen = await repo.get_last_seen(last_seen_key)
+class _Cycle:
+    def __init__(
+        self,
+        *,
+        repo,
+        feed_client,
+        scorer: CompiledScorer,
+        breaker,
+        seen: SeenIndex | None,
+        near_dupes: NearDuplicateIndex | None,
+        min_score: int,
+        max_results: int,
+        chat_id: int,
+        instant_score: int | None,
+    ) -> None:
+        self.repo = repo
+        self.feed_client = feed_client
+        self.scorer = scorer
+        self.breaker = breaker
+        self.seen = seen
+        self.near_dupes = near_dupes
+        self.min_score = min_score
+        self.max_results = max_results
+        self.chat_id = chat_id
+        self.instant_score = instant_score
+        self.report = CycleReport()
+        # Candidates from all sources compete for max_results through a bounded min-heap,
+        # so the limit keeps the best leads rather than the ones from the first sources.
+        self.top: list[tuple[int, int, dict[str, Any]]] = []
+        # Candidates that lost the cut, best first; they refill slots freed at store time.
+        self.reserve: list[tuple[int, int, dict[str, Any]]] = []
+        self.progress: dict[int, _SourceProgress] = {}
+        self.errors: dict[int, BaseException] = {}
+        self.sequence = 0
+
+    async def fetch(self, source: dict[str, Any], evaluate: Stage) -> None:
         try:
-            items = await fetch_feed_items(
-                feed_client,
-                url=source["value"],
-                count=FETCH_COUNT,
-            )
-        except Exception:
-            logger.exception("Feed fetch failed: %s", source.get("value"))
-            continue
-        max_date = last_seen or 0
+            result: Any = await _fetch_source(self.repo, self.feed_client, source)
+        except Exception as exc:
+            result = exc
+        await evaluate.put((source, result))
+
+    async def evaluate(self, fetched: tuple[dict[str, Any], Any]) -> None:
+        source, result = fetched
+        source_id = int(source["id"])
+        if isinstance(result, BaseException):
+            logger.error("Feed fetch failed: %s", source.get("value"), exc_info=result)
+            self.report.failed.add(source_id)
+            self.errors[source_id] = result
+            return
+        items, old_validators, new_validators = result
+        seen = self.seen
+        last_seen = await self.repo.get_last_seen(f"last_seen:feed:{source_id}")
+        new_items = 0
+        progress = _SourceProgress(source_id, last_seen, last_seen or 0, old_validators, new_validators)
+        self.progress[source_id] = progress
+        source_label = f"Feed: {source.get('title') or source.get('value')}"
         for item in items:
-            if leads_sent >= max_results:
-                break
             published_ts = int(item.get("published_ts", 0))
             if last_seen and published_ts and published_ts <= last_seen:
                 continue
-            max_date = max(max_date, published_ts)
-            inserted = await _process_post(
-                repo=repo,
-                bot=bot,
-                config=config,
+            progress.max_date = max(progress.max_date, published_ts)
+            item_id = str(item.get("item_id") or "")
+            if seen is not None and item_id and seen.peek(source_id, item_id):
+                seen.check_and_add(source_id, item_id)
+                continue
+            # Only items past last_seen that are not in the seen index count as new;
+            # older ones skipped above drop out of the index after its TTL.
+            if seen is not None:
+                new_items += bool(item_id)
+            elif published_ts > (last_seen or 0):
+                new_items += 1
+            progress.evaluated.append(item_id)
+            candidate = await _evaluate_item(
+                repo=self.repo,
                 item=item,
                 source_id=source_id,
-                source_label=f"Feed: {source.get('title') or source.get('value')}",
-                keywords=keywords,
-                neg_keywords=neg_keywords,
-                min_score=min_score,
-                lang_filter=lang_filter,
-                target=target,
-                channel_id=channel_id,
+                source_label=source_label,
+                scorer=self.scorer,
+                min_score=self.min_score,
+                near_dupes=self.near_dupes,
             )
+            if candidate is not None:
+                self._offer(candidate)
+        if last_seen:
+            self.report.new_items[source_id] = new_items
+
+    def _offer(self, candidate: dict[str, Any]) -> None:
+        self.sequence += 1
+        entry = (candidate["score"], -self.sequence, candidate)
+        if len(self.top) < self.max_results:
+            heapq.heappush(self.top, entry)
+            return
+        if self.top and entry > self.top[0]:
+            entry = heapq.heapreplace(self.top, entry)
+        score, order, dropped = entry
+        heapq.heappush(self.reserve, (-score, -order, dropped))
+        progress = self.progress[dropped["source_id"]]
+        progress.carried.append(dropped["published_ts"])
+        progress.evaluated.remove(dropped["source_item_id"])
+
+    def _refill(self) -> dict[str, Any] | None:
+        if not self.reserve:
+            return None
+        candidate = heapq.heappop(self.reserve)[2]
+        progress = self.progress[candidate["source_id"]]
+        progress.carried.remove(candidate["published_ts"])
+        progress.evaluated.append(candidate["source_item_id"])
+        return candidate
+
+    def selected(self) -> list[dict[str, Any]]:
+        return [candidate for _, _, candidate in sorted(self.top, reverse=True)]
+
+    async def store(self, candidate: dict[str, Any] | None) -> None:
+        while candidate is not None:
+            progress = self.progress[candidate["source_id"]]
+            item_id = candidate["source_item_id"]
+            progress.pending[item_id] = candidate["published_ts"]
+            inserted = await _store_lead(
+                repo=self.repo,
+                candidate=candidate,
+                near_dupes=self.near_dupes,
+                chat_id=self.chat_id,
+                instant_score=self.instant_score,
+            )
+            # A failed store raises above and leaves the item pending, so it is retried.
+            del progress.pending[item_id]
             if inserted:
-                leads_sent += 1
-        if max_date and max_date != (last_seen or 0):
-            await repo.set_last_seen(last_seen_key, max_date)
+                self.report.leads_sent += 1
+                return
+            # A duplicate of a lead stored earlier in this cycle frees its slot.
+            candidate = self._refill()
 
-    await repo.set_last_check_at()
-    logger.info("Monitoring cycle done (%s). leads_sent=%s", reason, leads_sent)
-    return leads_sent
+    async def finish(self) -> None:
+        if self.breaker is not None:
+            for source_id, error in self.errors.items():
+                await self.breaker.record_failure(source_id, error)
+            for source_id in self.progress:
+                await self.breaker.record_success(source_id)
+        carried = 0
+        for progress in self.progress.values():
+            source_id = progress.source_id
+            if self.seen is not None:
+                for item_id in progress.evaluated:
+                    if item_id and item_id not in progress.pending:
+                        self.seen.check_and_add(source_id, item_id)
+            max_date = progress.max_date
+            held = progress.carried + list(progress.pending.values())
+            if held:
+                # Items that lost the top-N cut or failed to store stay unseen: last_seen
+                # stops right before the oldest of them and the validators are kept, so
+                # they are evaluated again.
+                carried += len(held)
+                dated = [ts for ts in held if ts]
+                if dated:
+                    max_date = min(max_date, min(dated) - 1)
+            if max_date and max_date > (progress.last_seen or 0):
+                await self.repo.set_last_seen(f"last_seen:feed:{source_id}", max_date)
+            if not held and progress.new_validators != progress.old_validators:
+                await self.repo.set_feed_validators(source_id, progress.new_validators)
+        if carried:
+            logger.info("Carried over to the next cycle: %s candidates", carried)
 
 
-async def _process_post(
+async def run_monitoring_cycle(
     *,
     repo,
-    bot,
+    feed_client,
     config,
+    force: bool,
+    reason: str,
+    sources: list[dict[str, Any]] | None = None,
+    breaker=None,
+    scorer_cache: ScorerCache | None = None,
+    seen: SeenIndex | None = None,
+    near_dupes: NearDuplicateIndex | None = None,
+) -> CycleReport:
+    settings = await repo.get_settings_snapshot()
+    if not settings.get_bool("monitoring_enabled", False) and not force:
+        return CycleReport()
+
+    scorer = await (scorer_cache or ScorerCache()).get(repo, settings.get("lang_filter") or "BOTH")
+    if scorer is None:
+        return CycleReport()
+
+    min_score = settings.get_int("min_score", config.default_min_score)
+    max_results = settings.get_int("max_results", config.default_max_results_per_cycle)
+    target = settings.get("target") or "ADMIN"
+    channel_id = settings.get("channel_id") or ""
+    chat_id = int(channel_id) if target == "CHANNEL" and channel_id else config.admin_id
+    instant_score = None
+    if (settings.get("delivery_mode") or "INSTANT") == "DIGEST":
+        instant_score = settings.get_int("digest_instant_score", config.default_digest_instant_score)
+
+    if sources is None:
+        sources = await repo.list_sources_all("feed")
+    if breaker is not None:
+        sources = [source for source in sources if not breaker.is_open(int(source["id"]))]
+    if not sources:
+        return CycleReport()
+
+    cycle = _Cycle(
+        repo=repo,
+        feed_client=feed_client,
+        scorer=scorer,
+        breaker=breaker,
+        seen=seen,
+        near_dupes=near_dupes,
+        min_score=min_score,
+        max_results=max_results,
+        chat_id=chat_id,
+        instant_score=instant_score,
+    )
+    queue_size = config.pipeline_queue_size
+    # fetch -> evaluate run concurrently; store starts once every source was evaluated,
+    # because the global top-N is only known then. Delivery is the outbox sender's job.
+    evaluate = Stage("evaluate", cycle.evaluate, config.pipeline_evaluate_workers, queue_size)
+    fetch = Stage(
+        "fetch",
+        lambda source: cycle.fetch(source, evaluate),
+        min(len(sources), config.feed_concurrency),
+        queue_size,
+    )
+    store = Stage("store", cycle.store, config.pipeline_store_workers, queue_size)
+    commits_before = repo.commits
+    started = time.perf_counter()
+    try:
+        # Fetch and evaluate only read, so the write transaction is opened just for
+        # the store phase and other writers are not held up while feeds download.
+        evaluate.start()
+        fetch.start()
+        for source in sources:
+            await fetch.put(source)
+        await fetch.close()
+        await evaluate.close()
+        write_started = time.perf_counter()
+        async with repo.batch():
+            store.start()
+            for candidate in cycle.selected():
+                await store.put(candidate)
+            await store.close()
+            await cycle.finish()
+            if seen is not None:
+                await seen.checkpoint()
+            await repo.set_last_check_at()
+        metrics.observe("cycle_db_write_seconds", time.perf_counter() - write_started)
+    finally:
+        for stage in (fetch, evaluate, store):
+            stage.cancel()
+    report = cycle.report
+    interval = settings.get_int("poll_interval", config.default_poll_interval_seconds)
+    _record_cycle(time.perf_counter() - started, interval, report)
+    logger.info(
+        "Monitoring cycle done (%s). leads_sent=%s commits=%s",
+        reason,
+        report.leads_sent,
+        repo.commits - commits_before,
+    )
+    return report
+
+
+def _record_cycle(duration: float, interval: int, report: CycleReport) -> None:
+    metrics.observe("cycle_seconds", duration)
+    metrics.set("cycle_last_seconds", duration)
+    metrics.set("cycle_interval_seconds", interval)
+    metrics.inc("cycle_leads_total", report.leads_sent)
+    if report.failed:
+        metrics.inc("cycle_failed_sources_total", len(report.failed))
+    # A cycle that outlives the poll interval means sources are polled late.
+    if duration > interval:
+        metrics.inc("cycle_overruns_total")
+
+
+async def _fetch_source(
+    repo,
+    feed_client,
+    source: dict[str, Any],
+) -> tuple[list[dict[str, Any]], dict[str, str], dict[str, str]]:
+    validators = await repo.get_feed_validators(int(source["id"]))
+    items, new_validators = await fetch_feed_items(
+        feed_client,
+        url=source["value"],
+        count=FETCH_COUNT,
+        validators=validators,
+    )
+    return items, validators, new_validators
+
+
+async def _evaluate_item(
+    *,
+    repo,
     item: dict[str, Any],
     source_id: int,
     source_label: str,
-    keywords: list[dict[str, Any]],
-    neg_keywords: list[str],
+    scorer: CompiledScorer,
     min_score: int,
-    lang_filter: str,
-    target: str,
-    channel_id: str,
-) -> bool:
+    near_dupes: NearDuplicateIndex | None,
+) -> dict[str, Any] | None:
     text = (item.get("text") or "").strip()
     if not text:
-        return False
+        return None
 
-    score, matched = score_text(text, keywords, neg_keywords, lang_filter)
+    score, matched = scorer.score(text)
+    metrics.inc("items_scored_total")
     if score < min_score:
-        return False
+        return None
 
     item_id = item.get("item_id")
     if not item_id:
-        return False
+        return None
 
-    link = item.get("link") or ""
     t_hash = text_hash(text)
     if await repo.lead_exists(source_id, str(item_id), t_hash):
-        return False
+        metrics.inc("dedupe_hits_total", kind="db")
+        return None
+
+    # Reposts are dropped before the top-N cut so they do not take the slots of new leads.
+    fingerprint = simhash(text) if near_dupes is not None else None
+    if near_dupes is not None:
+        original_id = near_dupes.find(fingerprint)
+        if original_id is not None:
+            logger.info("Near-duplicate of lead %s suppressed: %s", original_id, item.get("link"))
+            return None
 
-    contacts = extract_contacts(text)
-    payload = {
+    return {
         "source_id": int(source_id),
         "source_item_id": str(item_id),
         "text": text,
         "text_hash": t_hash,
-        "link": link,
+        "link": item.get("link") or "",
         "score": score,
         "matched_keywords": matched,
-        "contacts": contacts,
         "status": "NEW",
         "source": source_label,
+        "published_ts": int(item.get("published_ts", 0)),
+        "simhash": fingerprint,
     }
 
-    lead_id = await repo.add_lead(payload)
-    if lead_id is None:
-        return False
-
-    payload["id"] = lead_id
-    message = format_lead_message(payload)
-    await _send_lead(bot, config.admin_id, target, channel_id, message, lead_id)
-    return True
-
 
-async def _send_lead(bot, admin_id: int, target: str, channel_id: str, text: str, lead_id: int) -> None:
-    from bot.keyboards.inline import lead_actions_kb
+async def _insert_lead(repo, payload: dict[str, Any], near_dupes: NearDuplicateIndex | None) -> int | None:
+    if near_dupes is None:
+        return await repo.add_lead(payload)
+    fingerprint = payload.get("simhash")
+    # Only catches reposts among this cycle's own candidates: older leads were
+    # already checked when the item was evaluated. find and add are one step under
+    # the index lock, otherwise two store workers could both pass find with reposts
+    # of each other before either was added.
+    async with near_dupes.lock:
+        original_id = near_dupes.find(fingerprint)
+        if original_id is not None:
+            logger.info("Near-duplicate of lead %s suppressed: %s", original_id, payload["link"])
+            return None
+        lead_id = await repo.add_lead(payload)
+        if lead_id is not None:
+            await near_dupes.add(lead_id, fingerprint)
+    return lead_id
 
-    if target == "CHANNEL" and channel_id:
-        chat_id = int(channel_id)
-    else:
-        chat_id = admin_id
 
+async def _store_lead(
+    *,
+    repo,
+    candidate: dict[str, Any],
+    near_dupes: NearDuplicateIndex | None,
+    chat_id: int,
+    instant_score: int | None,
+) -> bool:
+    payload = dict(candidate, contacts=extract_contacts(candidate["text"]))
+    lead_id = await _insert_lead(repo, payload, near_dupes)
+    if lead_id is None:
+        return False
     try:
-        await bot.send_message(chat_id=chat_id, text=text, reply_markup=lead_actions_kb(lead_id))
+        if instant_score is not None and payload["score"] < instant_score:
+            await repo.add_digest_item(lead_id, chat_id)
+        else:
+            from bot.keyboards.inline import lead_actions_kb
+
+            payload["id"] = lead_id
+            message = format_lead_message(payload)
+            await repo.enqueue_outbox(chat_id, message, dump_markup(lead_actions_kb(lead_id)), lead_id)
     except Exception:
-        logger.exception("Failed to send lead to chat_id=%s", chat_id)
+        # An undelivered lead would turn its own retry into a duplicate.
+        if near_dupes is not None:
+            near_dupes.discard(lead_id, candidate.get("simhash"))
+        await repo.delete_leads([lead_id])
+        raise
+    return True
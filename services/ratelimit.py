@@ -0,0 +1,34 @@
+﻿from __future__ import annotations
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self._rate = max(rate, 1e-6)
+        self._capacity = max(1.0, capacity)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1.0) -> float:
+        self._refill()
+        if self._tokens >= tokens:
+            return 0.0
+        return (tokens - self._tokens) / self._rate
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
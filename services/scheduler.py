@@ -1,22 +1,67 @@
 ﻿from __future__ import annotations
 
+import asyncio
+import heapq
 import logging
+import random
+import time
+from typing import Any
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+from services.breaker import CircuitBreaker
+from services.digest import flush_digests
+from services.neardup import NearDuplicateIndex
+from services.outbox import OutboxSender
 from services.pipeline import run_monitoring_cycle
+from services.ratelimit import TokenBucket
+from services.retention import run_retention
+from services.scoring import ScorerCache
+from services.seen import SeenIndex
 
 logger = logging.getLogger(__name__)
 
+TICK_SECONDS = 1
+DIGEST_CHECK_SECONDS = 30
+SOURCES_REFRESH_SECONDS = 30
+JITTER = 0.1
+SPEEDUP = 0.5
+SLOWDOWN = 1.5
+
 
 class SchedulerService:
     def __init__(self, repo, feed_client, bot, config) -> None:
         self._repo = repo
         self._feed_client = feed_client
-        self._bot = bot
         self._config = config
         self._scheduler: AsyncIOScheduler | None = None
         self._job_id = "monitoring_job"
+        self._base_interval = float(config.default_poll_interval_seconds)
+        self._queue: list[tuple[float, int]] = []
+        self._due: dict[int, float] = {}
+        # Sources handed to a running batch: only that batch re-queues them when it ends.
+        self._in_flight: set[int] = set()
+        self._intervals: dict[int, float] = {}
+        self._sources: dict[int, dict[str, Any]] = {}
+        self._sources_refreshed_at = 0.0
+        self._batches: set[asyncio.Task] = set()
+        self._backfill: asyncio.Task | None = None
+        self._breaker = CircuitBreaker(
+            repo,
+            threshold=config.breaker_failure_threshold,
+            base_cooldown=config.breaker_base_cooldown_seconds,
+            max_cooldown=config.breaker_max_cooldown_seconds,
+        )
+        self._outbox = OutboxSender(repo, bot)
+        self._scorer_cache = ScorerCache()
+        self._seen = SeenIndex(repo, ttl_seconds=config.seen_ttl_hours * 3600)
+        self._near_dupes = NearDuplicateIndex(
+            repo,
+            max_distance=config.near_dup_max_distance,
+            window_seconds=config.near_dup_window_hours * 3600,
+        )
+        per_minute = max(1, config.poll_max_requests_per_minute)
+        self._rate = TokenBucket(rate=per_minute / 60, capacity=max(1, per_minute // 6))
 
     async def start(self) -> None:
         if self._scheduler and self._scheduler.running:
@@ -24,15 +69,37 @@ class SchedulerService:
         interval = await self._repo.get_int_setting(
             "poll_interval", self._config.default_poll_interval_seconds
         )
+        self._base_interval = self._clamp(interval)
+        await self._breaker.load()
+        await self._seen.load()
+        await self._near_dupes.load()
+        self._outbox.start()
+        self._backfill = asyncio.create_task(self._run_backfills())
         self._scheduler = AsyncIOScheduler(timezone="UTC")
         self._scheduler.add_job(
             self._run_job,
             "interval",
-            seconds=interval,
+            seconds=TICK_SECONDS,
             id=self._job_id,
             max_instances=1,
             coalesce=True,
         )
+        self._scheduler.add_job(
+            self._run_digest_job,
+            "interval",
+            seconds=DIGEST_CHECK_SECONDS,
+            id="digest_job",
+            max_instances=1,
+            coalesce=True,
+        )
+        self._scheduler.add_job(
+            self._run_retention_job,
+            "interval",
+            hours=max(1, self._config.retention_interval_hours),
+            id="retention_job",
+            max_instances=1,
+            coalesce=True,
+        )
         self._scheduler.start()
         logger.info("Scheduler started with interval=%s", interval)
 
@@ -40,22 +107,158 @@ class SchedulerService:
         if self._scheduler:
             self._scheduler.shutdown(wait=False)
             self._scheduler = None
+        for task in self._batches:
+            task.cancel()
+        if self._backfill is not None:
+            self._backfill.cancel()
+            await asyncio.gather(self._backfill, return_exceptions=True)
+            self._backfill = None
+        await self._outbox.stop()
+        await self._seen.checkpoint()
 
     async def reschedule(self, interval: int) -> None:
-        if not self._scheduler:
-            return
-        self._scheduler.reschedule_job(self._job_id, trigger="interval", seconds=interval)
+        self._base_interval = self._clamp(interval)
+        now = time.monotonic()
+        self._queue = []
+        self._due = {}
+        self._intervals = {}
+        for source_id in self._sources:
+            if source_id not in self._in_flight:
+                self._push(source_id, now + random.uniform(0, self._base_interval))
         logger.info("Scheduler rescheduled to interval=%s", interval)
 
-    async def _run_job(self) -> None:
+    async def run_now(self) -> int:
+        report = await run_monitoring_cycle(
+            repo=self._repo,
+            feed_client=self._feed_client,
+            config=self._config,
+            force=True,
+            reason="manual",
+            breaker=self._breaker,
+            scorer_cache=self._scorer_cache,
+            seen=self._seen,
+            near_dupes=self._near_dupes,
+        )
+        if report.leads_sent:
+            self._outbox.notify()
+        return report.leads_sent
+
+    def _clamp(self, interval: float) -> float:
+        low = self._config.poll_min_interval_seconds
+        high = max(low, self._config.poll_max_interval_seconds)
+        return float(min(high, max(low, interval)))
+
+    def _push(self, source_id: int, due_at: float) -> None:
+        self._due[source_id] = due_at
+        heapq.heappush(self._queue, (due_at, source_id))
+
+    async def _refresh_sources(self, now: float) -> None:
+        sources = await self._repo.list_sources_all("feed")
+        self._sources = {int(source["id"]): source for source in sources}
+        for source_id in list(self._due):
+            if source_id not in self._sources:
+                del self._due[source_id]
+                self._intervals.pop(source_id, None)
+        for source_id in self._sources:
+            if source_id not in self._due and source_id not in self._in_flight:
+                self._push(source_id, now + random.uniform(0, self._base_interval))
+        self._sources_refreshed_at = now
+
+    def _pop_due(self, now: float) -> list[dict[str, Any]]:
+        batch: list[dict[str, Any]] = []
+        while self._queue and self._queue[0][0] <= now:
+            due_at, source_id = self._queue[0]
+            if self._due.get(source_id) != due_at:
+                heapq.heappop(self._queue)
+                continue
+            if not self._rate.try_acquire():
+                break
+            heapq.heappop(self._queue)
+            del self._due[source_id]
+            self._in_flight.add(source_id)
+            batch.append(self._sources[source_id])
+        return batch
+
+    def _next_interval(self, source_id: int, new_items: int | None) -> float:
+        interval = self._intervals.get(source_id, self._base_interval)
+        if new_items:
+            interval *= SPEEDUP
+        elif new_items is not None:
+            interval *= SLOWDOWN
+        interval = self._clamp(interval)
+        self._intervals[source_id] = interval
+        return interval
+
+    async def _tick(self) -> None:
+        if not await self._repo.get_bool_setting("monitoring_enabled", False):
+            return
+        now = time.monotonic()
+        if now - self._sources_refreshed_at >= SOURCES_REFRESH_SECONDS:
+            await self._refresh_sources(now)
+        batch = self._pop_due(now)
+        if not batch:
+            return
+        task = asyncio.create_task(self._run_batch(batch))
+        self._batches.add(task)
+        task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch: list[dict[str, Any]]) -> None:
+        new_items: dict[int, int] = {}
         try:
-            await run_monitoring_cycle(
+            report = await run_monitoring_cycle(
                 repo=self._repo,
                 feed_client=self._feed_client,
-                bot=self._bot,
                 config=self._config,
                 force=False,
                 reason="auto",
+                sources=batch,
+                breaker=self._breaker,
+                scorer_cache=self._scorer_cache,
+                seen=self._seen,
+                near_dupes=self._near_dupes,
+            )
+            new_items = report.new_items
+            if report.leads_sent:
+                self._outbox.notify()
+        except Exception:  # pragma: no cover - ensure batch errors are logged
+            logger.exception("Monitoring cycle failed")
+        finally:
+            done = time.monotonic()
+            for source in batch:
+                source_id = int(source["id"])
+                self._in_flight.discard(source_id)
+                if source_id not in self._sources:
+                    continue
+                interval = self._next_interval(source_id, new_items.get(source_id))
+                delay = max(interval * random.uniform(1 - JITTER, 1 + JITTER), self._breaker.remaining(source_id))
+                self._push(source_id, done + delay)
+
+    async def _run_digest_job(self) -> None:
+        try:
+            window = await self._repo.get_int_setting(
+                "digest_window", self._config.default_digest_window_seconds
             )
+            # Leaving digest mode sends whatever is still waiting right away.
+            force = (await self._repo.get_setting("delivery_mode")) != "DIGEST"
+            if await flush_digests(self._repo, window, force=force):
+                self._outbox.notify()
+        except Exception:  # pragma: no cover - ensure job never crashes
+            logger.exception("Digest flush failed")
+
+    async def _run_backfills(self) -> None:
+        try:
+            await self._repo.run_backfills()
+        except Exception:  # pragma: no cover - the bot keeps working on the old schema
+            logger.exception("Migration backfill failed")
+
+    async def _run_retention_job(self) -> None:
+        try:
+            await run_retention(self._repo, self._config.retention_ttl_days, self._config.archive_dir)
+        except Exception:  # pragma: no cover - ensure job never crashes
+            logger.exception("Retention failed")
+
+    async def _run_job(self) -> None:
+        try:
+            await self._tick()
         except Exception:  # pragma: no cover - ensure job never crashes
             logger.exception("Monitoring cycle failed")
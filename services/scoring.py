@@ -3,6 +3,8 @@
 import re
 from typing import Any
 
+from services.matcher import PhraseMatcher
+
 EXTRA_SIGNALS = {
     "продаю": 8,
     "куплю": 6,
@@ -68,49 +70,84 @@ def _keyword_allowed(lang: str, lang_filter: str) -> bool:
     return lang == lang_filter
 
 
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class CompiledScorer:
+    def __init__(
+        self,
+        keywords: list[dict[str, Any]],
+        neg_keywords: list[str],
+        lang_filter: str,
+    ) -> None:
+        phrases: list[str] = []
+        for kw in keywords:
+            phrase = kw.get("phrase", "").strip()
+            if not phrase:
+                continue
+            if not _keyword_allowed(kw.get("lang", "BOTH"), lang_filter):
+                continue
+            phrases.append(phrase)
+        negs = [neg.lower() for neg in neg_keywords]
+
+        self._matcher = PhraseMatcher(
+            [phrase.lower() for phrase in phrases]
+            + list(EXTRA_SIGNALS)
+            + AREAS
+            + NEGATIVE_LOCATIONS
+            + negs
+        )
+        pid = self._matcher.pattern_id
+        self._keywords = [(phrase, pid(phrase.lower())) for phrase in phrases]
+        self._signals = [(pid(word), weight) for word, weight in EXTRA_SIGNALS.items()]
+        self._areas = [pid(area) for area in AREAS]
+        self._neg_locations = [pid(neg) for neg in NEGATIVE_LOCATIONS]
+        self._negs = [pid(neg) for neg in negs]
+
+    def score(self, text: str) -> tuple[int, list[str]]:
+        text_norm = _normalize(text)
+        found = self._matcher.find(text_norm)
+
+        matched_keywords = [phrase for phrase, pattern in self._keywords if pattern in found]
+        if not matched_keywords:
+            return 0, []
+
+        score = min(60, len(matched_keywords) * 12)
+        score += sum(weight for pattern, weight in self._signals if pattern in found)
+
+        if PRICE_RE.search(text_norm):
+            score += 8
+        if TIME_RE.search(text_norm):
+            score += 6
+
+        score += 6 * sum(1 for pattern in self._areas if pattern in found)
+        score -= 15 * sum(1 for pattern in self._neg_locations if pattern in found)
+        score -= 20 * sum(1 for pattern in self._negs if pattern in found)
+
+        score = max(0, min(100, score))
+        return score, matched_keywords
+
+
+class ScorerCache:
+    def __init__(self) -> None:
+        self._key: tuple[int, str] | None = None
+        self._scorer: CompiledScorer | None = None
+
+    async def get(self, repo, lang_filter: str) -> CompiledScorer | None:
+        key = (repo.keywords_version, lang_filter)
+        if key != self._key:
+            keywords = await repo.list_keywords_all()
+            neg_keywords = await repo.list_neg_keywords()
+            self._scorer = CompiledScorer(keywords, neg_keywords, lang_filter) if keywords else None
+            self._key = key
+        return self._scorer
+
+
 def score_text(
     text: str,
     keywords: list[dict[str, Any]],
     neg_keywords: list[str],
     lang_filter: str,
 ) -> tuple[int, list[str]]:
-    text_norm = " ".join(text.lower().split())
-
-    matched_keywords: list[str] = []
-    for kw in keywords:
-        phrase = kw.get("phrase", "").strip()
-        if not phrase:
-            continue
-        if not _keyword_allowed(kw.get("lang", "BOTH"), lang_filter):
-            continue
-        if phrase.lower() in text_norm:
-            matched_keywords.append(phrase)
-
-    if not matched_keywords:
-        return 0, []
-
-    score = min(60, len(matched_keywords) * 12)
-
-    for word, weight in EXTRA_SIGNALS.items():
-        if word in text_norm:
-            score += weight
-
-    if PRICE_RE.search(text_norm):
-        score += 8
-    if TIME_RE.search(text_norm):
-        score += 6
-
-    for area in AREAS:
-        if area in text_norm:
-            score += 6
-
-    for neg in NEGATIVE_LOCATIONS:
-        if neg in text_norm:
-            score -= 15
-
-    for neg in neg_keywords:
-        if neg.lower() in text_norm:
-            score -= 20
-
-    score = max(0, min(100, score))
-    return score, matched_keywords
+    return CompiledScorer(keywords, neg_keywords, lang_filter).score(text)
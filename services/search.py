@@ -0,0 +1,39 @@
+﻿from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+
+STATUSES = ("NEW", "IN_PROGRESS", "COLD", "TRASH")
+MAX_TERMS = 8
+
+TERM_RE = re.compile(r"\w+")
+FILTER_RE = re.compile(r"(?i)\b(status|score|source):(\S+)")
+
+
+@dataclass(frozen=True)
+class SearchQuery:
+    text: str
+    match: str
+    status: str | None = None
+    min_score: int | None = None
+    source: str | None = None
+
+
+def parse_search(raw: str) -> SearchQuery | None:
+    status = min_score = source = None
+    for name, value in FILTER_RE.findall(raw):
+        name = name.lower()
+        if name == "status" and value.upper() in STATUSES:
+            status = value.upper()
+        elif name == "score" and value.isdigit():
+            min_score = int(value)
+        elif name == "source":
+            source = value
+    text = " ".join(FILTER_RE.sub(" ", raw).split())
+    terms = TERM_RE.findall(text.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    # Every word becomes a quoted prefix term, so user input never reaches the FTS5
+    # query syntax and "квартир" still finds "квартиру" / "квартира".
+    match = " ".join(f'"{term}"*' for term in terms)
+    return SearchQuery(text=text, match=match, status=status, min_score=min_score, source=source)
@@ -0,0 +1,105 @@
+﻿from __future__ import annotations
+
+import hashlib
+import logging
+import time
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+PRUNE_EVERY_SECONDS = 3600
+
+
+def item_key(source_id: int, item_id: str) -> int:
+    digest = hashlib.blake2b(f"{source_id}:{item_id}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class SeenIndex:
+    def __init__(self, repo, ttl_seconds: int) -> None:
+        self._repo = repo
+        self._ttl = max(60, ttl_seconds)
+        self._entries: dict[int, int] = {}
+        self._dirty: dict[int, int] = {}
+        # State before the first change of each key in the current write batch.
+        self._undo: dict[int, tuple[int | None, int | None]] | None = None
+        self._pruned_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def load(self) -> None:
+        since = int(time.time()) - self._ttl
+        self._entries = dict(await self._repo.load_seen_items(since))
+        logger.info("Seen index loaded: %s items", len(self._entries))
+
+    def peek(self, source_id: int, item_id: str) -> bool:
+        seen_at = self._entries.get(item_key(source_id, item_id))
+        return seen_at is not None and seen_at >= time.time() - self._ttl
+
+    def _track(self, key: int) -> None:
+        # Items marked inside a write batch must become unseen again if it rolls back,
+        # otherwise leads that were never stored would be skipped until the TTL.
+        if not self._repo.in_batch():
+            return
+        if self._undo is None:
+            self._undo = {}
+            self._repo.on_rollback(self._rollback)
+            self._repo.after_commit(self._committed)
+        if key not in self._undo:
+            self._undo[key] = (self._entries.get(key), self._dirty.get(key))
+
+    def _rollback(self) -> None:
+        undo, self._undo = self._undo or {}, None
+        for key, (seen_at, source_id) in undo.items():
+            if seen_at is None:
+                self._entries.pop(key, None)
+            else:
+                self._entries[key] = seen_at
+            if source_id is None:
+                self._dirty.pop(key, None)
+            else:
+                self._dirty[key] = source_id
+
+    def _committed(self) -> None:
+        self._undo = None
+
+    def check_and_add(self, source_id: int, item_id: str) -> bool:
+        now = int(time.time())
+        key = item_key(source_id, item_id)
+        seen_at = self._entries.get(key)
+        if seen_at is not None and seen_at >= now - self._ttl:
+            self.hits += 1
+            metrics.inc("seen_index_hits_total")
+            # Items that stay in the feed are kept alive, but only rewritten twice per TTL.
+            if now - seen_at > self._ttl // 2:
+                self._track(key)
+                self._entries[key] = now
+                self._dirty[key] = source_id
+            return True
+        self.misses += 1
+        metrics.inc("seen_index_misses_total")
+        self._track(key)
+        self._entries[key] = now
+        self._dirty[key] = source_id
+        return False
+
+    async def checkpoint(self) -> None:
+        if self._dirty:
+            rows = [(key, source_id, self._entries[key]) for key, source_id in self._dirty.items()]
+            # A rolled back save has to leave these keys dirty again.
+            for key in self._dirty:
+                self._track(key)
+            self._dirty = {}
+            await self._repo.save_seen_items(rows)
+        metrics.set("seen_index_items", len(self._entries))
+        now = time.time()
+        if now - self._pruned_at < PRUNE_EVERY_SECONDS:
+            return
+        cutoff = int(now) - self._ttl
+        self._entries = {key: seen_at for key, seen_at in self._entries.items() if seen_at >= cutoff}
+        await self._repo.prune_seen_items(cutoff)
+        self._pruned_at = now
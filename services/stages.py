@@ -0,0 +1,60 @@
+﻿from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Any], Awaitable[None]],
+        workers: int = 1,
+        queue_size: int = 32,
+    ) -> None:
+        self.name = name
+        self._handler = handler
+        self._workers = max(1, workers)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self._workers)]
+
+    async def put(self, item: Any) -> None:
+        # A full queue blocks the producer, which is what pushes back on upstream stages.
+        await self._queue.put(item)
+        metrics.set("pipeline_queue_depth", self._queue.qsize(), stage=self.name)
+
+    async def close(self) -> None:
+        for _ in self._tasks:
+            await self._queue.put(_DONE)
+        await asyncio.gather(*self._tasks)
+        metrics.set("pipeline_queue_depth", 0, stage=self.name)
+
+    def cancel(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+    async def _work(self) -> None:
+        while True:
+            item = await self._queue.get()
+            metrics.set("pipeline_queue_depth", self._queue.qsize(), stage=self.name)
+            if item is _DONE:
+                return
+            started = time.perf_counter()
+            try:
+                await self._handler(item)
+            except Exception:
+                metrics.inc("pipeline_stage_errors_total", stage=self.name)
+                logger.exception("Pipeline stage %s failed", self.name)
+            metrics.observe("pipeline_stage_seconds", time.perf_counter() - started, stage=self.name)
+            metrics.inc("pipeline_items_total", stage=self.name)
@@ -0,0 +1,93 @@
+﻿from __future__ import annotations
+
+from typing import Any
+
+LabelKey = tuple[str, tuple[tuple[str, str], ...]]
+
+
+def _key(name: str, labels: dict[str, Any]) -> LabelKey:
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._counters: dict[LabelKey, float] = {}
+        self._gauges: dict[LabelKey, float] = {}
+        self._summaries: dict[LabelKey, list[float]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        key = _key(name, labels)
+        self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels: Any) -> None:
+        self._gauges[_key(name, labels)] = float(value)
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = _key(name, labels)
+        summary = self._summaries.get(key)
+        if summary is None:
+            self._summaries[key] = [1.0, value, value]
+            return
+        summary[0] += 1
+        summary[1] += value
+        summary[2] = max(summary[2], value)
+
+    def counter(self, name: str, **labels: Any) -> float:
+        return self._counters.get(_key(name, labels), 0.0)
+
+    def gauge(self, name: str, **labels: Any) -> float:
+        return self._gauges.get(_key(name, labels), 0.0)
+
+    def summary(self, name: str, **labels: Any) -> tuple[int, float, float]:
+        count, total, peak = self._summaries.get(_key(name, labels), (0.0, 0.0, 0.0))
+        return int(count), total, peak
+
+    def counter_total(self, name: str) -> float:
+        return sum(value for (key, _), value in self._counters.items() if key == name)
+
+    def summary_total(self, name: str) -> tuple[int, float, float]:
+        count = total = peak = 0.0
+        for (key, _), (n, value, high) in self._summaries.items():
+            if key == name:
+                count += n
+                total += value
+                peak = max(peak, high)
+        return int(count), total, peak
+
+    def render_prometheus(self) -> str:
+        lines: list[str] = []
+        for kind, series in (("counter", self._counters), ("gauge", self._gauges)):
+            for name, samples in _families(series):
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{_labels(labels)} {value!r}" for labels, value in samples)
+        summaries = _families(self._summaries)
+        for name, samples in summaries:
+            lines.append(f"# TYPE {name} summary")
+            for labels, (count, total, _) in samples:
+                lines.append(f"{name}_sum{_labels(labels)} {total!r}")
+                lines.append(f"{name}_count{_labels(labels)} {count!r}")
+        # The peak is not part of the summary type, so it is exported as its own gauge.
+        for name, samples in summaries:
+            lines.append(f"# TYPE {name}_max gauge")
+            lines.extend(f"{name}_max{_labels(labels)} {peak!r}" for labels, (_, _, peak) in samples)
+        return "\n".join(lines) + "\n"
+
+
+def _families(series: dict[LabelKey, Any]) -> list[tuple[str, list[tuple[tuple[tuple[str, str], ...], Any]]]]:
+    families: dict[str, list[tuple[tuple[tuple[str, str], ...], Any]]] = {}
+    for (name, labels), value in sorted(series.items()):
+        families.setdefault(name, []).append((labels, value))
+    return list(families.items())
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+metrics = MetricsRegistry()
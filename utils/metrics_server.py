@@ -0,0 +1,25 @@
+﻿from __future__ import annotations
+
+import logging
+
+from aiohttp import web
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+async def _handle_metrics(_: web.Request) -> web.Response:
+    return web.Response(body=metrics.render_prometheus().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics endpoint listening on http://%s:%s/metrics", host, port)
+    return runner